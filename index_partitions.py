@@ -0,0 +1,139 @@
+"""
+Índices particionados por ano (ES_PARTITION_BY_YEAR=1).
+
+Cada documento é escrito em `<ES_INDEX>-<ano>` (ano de entities.date, o
+campo `year` do ingest; sem data: `<ES_INDEX>-undated`). Um index template
+dá a todas as partições o mesmo mapping e o alias de leitura `<ES_INDEX>`,
+por isso pesquisas, contagens e a limpeza continuam a usar ES_INDEX.
+Pesquisas com intervalo de datas só consultam os anos que o intervalo
+cobre (indices_for_range). Anos fechados podem ser compactados e ficar só
+de leitura (freeze_partition).
+
+Partilhado pelo ingest.py (escrita) e pela webapp (pesquisa).
+"""
+import os
+import time
+
+PARTITION_BY_YEAR = os.environ.get("ES_PARTITION_BY_YEAR", "0") == "1"
+UNDATED = "undated"
+# Cache da lista de partições usada pelo planeamento das pesquisas (segundos)
+PARTITIONS_TTL_S = 60
+
+_partitions_cache = {}  # alias -> (instante, [nomes])
+
+
+def partition_name(alias: str, year) -> str:
+    return f"{alias}-{year or UNDATED}"
+
+
+def write_index(alias: str, year) -> str:
+    """Índice onde escrever um documento desse ano."""
+    return partition_name(alias, year) if PARTITION_BY_YEAR else alias
+
+
+def ensure_template(es, alias: str, settings: dict, mappings: dict):
+    """Index template das partições (mapping + alias de leitura)."""
+    if es.indices.exists(index=alias) and not es.indices.exists_alias(name=alias):
+        raise RuntimeError(
+            f"Já existe um índice '{alias}' não particionado. Apague-o (Definições → Reset) "
+            f"e reindexe, ou use outro ES_INDEX, para ativar ES_PARTITION_BY_YEAR."
+        )
+    es.indices.put_index_template(
+        name=f"{alias}-partitions",
+        index_patterns=[f"{alias}-*"],
+        template={"settings": settings, "mappings": mappings, "aliases": {alias: {}}},
+        priority=100,
+    )
+
+
+def set_template_settings(es, alias: str, overrides: dict):
+    """
+    Altera definições do template das partições (ex.: refresh_interval
+    durante uma carga em massa), para valerem também nas partições criadas
+    entretanto. None retira a definição.
+    """
+    name = f"{alias}-partitions"
+    found = es.indices.get_index_template(name=name)["index_templates"]
+    if not found:
+        return
+    body = found[0]["index_template"]
+    template = body.get("template", {})
+    index_settings = template.setdefault("settings", {}).setdefault("index", {})
+    for key, value in overrides.items():
+        if value is None:
+            index_settings.pop(key, None)
+        else:
+            index_settings[key] = value
+    es.indices.put_index_template(
+        name=name,
+        index_patterns=body["index_patterns"],
+        template=template,
+        priority=body.get("priority"),
+    )
+
+
+def list_partitions(es, alias: str, max_age: float = PARTITIONS_TTL_S) -> list:
+    """Nomes das partições atrás do alias (com cache curta)."""
+    cached = _partitions_cache.get(alias)
+    if cached and time.time() - cached[0] < max_age:
+        return cached[1]
+    try:
+        names = sorted(es.indices.get_alias(name=alias).keys())
+    except Exception:
+        names = []
+    _partitions_cache[alias] = (time.time(), names)
+    return names
+
+
+def _year(date_str: str):
+    try:
+        return int((date_str or "")[:4])
+    except ValueError:
+        return None
+
+
+def indices_for_range(es, alias: str, date_from: str = "", date_to: str = "") -> str:
+    """
+    Índices a pesquisar para um filtro de datas (YYYY-MM-DD). Sem partições
+    ou sem datas: o alias. Documentos sem data nunca cumprem o filtro, por
+    isso a partição "undated" fica de fora.
+    """
+    y0, y1 = _year(date_from), _year(date_to)
+    if not PARTITION_BY_YEAR or (y0 is None and y1 is None):
+        return alias
+    selected = []
+    prefix = f"{alias}-"
+    for name in list_partitions(es, alias):
+        year = _year(name[len(prefix):]) if name.startswith(prefix) else None
+        if year is None:
+            continue
+        if (y0 is None or year >= y0) and (y1 is None or year <= y1):
+            selected.append(name)
+    # Nenhum ano no intervalo: um índice inexistente (com ignore_unavailable) dá 0 resultados
+    return ",".join(selected) or partition_name(alias, y0 or y1)
+
+
+def delete_all(es, alias: str) -> bool:
+    """Apaga o índice ou, com partições, todas as partições do alias."""
+    _partitions_cache.pop(alias, None)
+    if es.indices.exists_alias(name=alias):
+        names = list(es.indices.get_alias(name=alias).keys())
+        es.indices.delete(index=",".join(names))
+        return True
+    if es.indices.exists(index=alias):
+        es.indices.delete(index=alias)
+        return True
+    return False
+
+
+def freeze_partition(es, alias: str, year: int, max_num_segments: int = 1):
+    """
+    Compacta a partição de um ano fechado e bloqueia escritas. Reindexar um
+    ficheiro desse ano falha até o bloqueio ser retirado
+    (index.blocks.write: false).
+    """
+    name = partition_name(alias, year)
+    t0 = time.perf_counter()
+    es.options(request_timeout=3600).indices.forcemerge(index=name, max_num_segments=max_num_segments)
+    es.indices.put_settings(index=name, settings={"index.blocks.write": True})
+    print(f"[INFO] Partição {name} compactada e só de leitura ({time.perf_counter() - t0:.1f}s)")
@@ -4,13 +4,20 @@ import hashlib
 import time
 import re
 from datetime import datetime
+from contextlib import closing
 import unicodedata
-import pytesseract
-import pdfplumber
-import pypdfium2
-from elasticsearch import Elasticsearch
-from tika import parser
-from PIL import Image
+import json
+import tempfile
+import threading
+
+# Dependências pesadas (pdfplumber, pypdfium2, PIL/NumPy, OCR, cliente ES)
+# só são importadas quando são precisas: uma execução "new_only" que salta
+# tudo, ou um import deste módulo, arranca depressa.
+import previews
+import index_partitions
+from parsers.spreadsheet_parser import parse_spreadsheet
+from parsers import tika_client
+from parsers import ocr_engine
 
 # Console UTF-8 (Windows safe)
 try:
@@ -21,22 +28,80 @@ except Exception:
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Modo lista: python ingest.py --files-from <lista.txt> (um caminho por linha),
+# usado pelos uploads para indexar só os ficheiros recebidos
+FILES_FROM = sys.argv[2] if len(sys.argv) > 2 and sys.argv[1] == "--files-from" else None
+# python ingest.py --complete-ocr: OCR completo dos documentos indexados em modo rápido
+COMPLETE_OCR = len(sys.argv) > 1 and sys.argv[1] == "--complete-ocr"
+# python ingest.py --retry-failed: volta a tentar os ficheiros cuja extração falhou
+RETRY_FAILED = len(sys.argv) > 1 and sys.argv[1] == "--retry-failed"
+# python ingest.py --worker <url da webapp>: worker remoto (ingest_remote.py)
+WORKER_URL = sys.argv[2] if len(sys.argv) > 2 and sys.argv[1] == "--worker" else None
+# ... --worker <url> --once: termina quando o coordenador não tiver mais trabalho
+WORKER_ONCE = bool(WORKER_URL) and len(sys.argv) > 3 and sys.argv[3] == "--once"
+# python ingest.py --freeze-year <ano>: compacta a partição do ano e bloqueia escritas
+FREEZE_YEAR = sys.argv[2] if len(sys.argv) > 2 and sys.argv[1] == "--freeze-year" else None
 # 1º argumento = pasta a indexar
-INCOMING_DIR = sys.argv[1] if len(sys.argv) > 1 else os.path.join(BASE_DIR, "incoming")
+INCOMING_DIR = (
+    sys.argv[1] if len(sys.argv) > 1 and not (FILES_FROM or COMPLETE_OCR or RETRY_FAILED or WORKER_URL or FREEZE_YEAR)
+    else os.path.join(BASE_DIR, "incoming")
+)
 # 2º argumento opcional = "new_only" (só ficheiros ainda não indexados)
 NEW_ONLY = len(sys.argv) > 2 and sys.argv[2] == "new_only"
 
+SUPPORTED_EXTS = [".pdf", ".png", ".jpg", ".jpeg", ".tiff", ".tif", ".xlsx", ".xls"]
+
+# Guardar também o texto de cada página (campo nested page_texts)
+PAGE_TEXT_INDEX = os.environ.get("PAGE_TEXT_INDEX", "1") == "1"
+
+# OCR rápido de PDFs digitalizados: só as faixas de cabeçalho/rodapé da
+# 1ª e da última página (onde estão NIF, nº, data e total).
+# OCR_FAST_POLICY: "defer" = OCR completo no fim da indexação; "skip" = só
+# com `python ingest.py --complete-ocr`
+OCR_MODE = os.environ.get("OCR_MODE", "full").strip().lower()
+OCR_FAST_POLICY = os.environ.get("OCR_FAST_POLICY", "defer").strip().lower()
+OCR_ROI_BAND = float(os.environ.get("OCR_ROI_BAND", "0.3"))  # fração da altura
+ROI_ENGINE = "tesseract-roi"
+
+# OCR adaptativo: degraus "dpi:psm" do mais barato ao mais caro. Uma página
+# só sobe de degrau se a confiança média (0-100) ficar abaixo de OCR_MIN_CONF.
+OCR_LADDER = [
+    (int(dpi), int(psm))
+    for dpi, psm in (
+        step.split(":") for step in os.environ.get("OCR_LADDER", "150:6,300:6,300:4").split(",") if step.strip()
+    )
+]
+OCR_MIN_CONF = float(os.environ.get("OCR_MIN_CONF", "70"))
+
+# Limite de texto guardado por documento (caracteres). O texto a mais é
+# descartado ("truncate") ou vai para documentos de continuação ("split",
+# <id>_p1, <id>_p2, ...). As entidades são sempre detetadas no texto todo.
+MAX_TEXT_CHARS = int(os.environ.get("INGEST_MAX_TEXT_CHARS", "1000000"))
+TEXT_OVERFLOW = os.environ.get("INGEST_TEXT_OVERFLOW", "truncate").strip().lower()
+
+# Gerar miniaturas (previews.py) durante a indexação
+PREVIEW_PREGEN = os.environ.get("PREVIEW_PREGEN", "0") == "1"
+
+# Carga em massa na reindexação completa de uma pasta: refresh desligado
+# (-1) e 0 réplicas enquanto dura; as definições originais são repostas no
+# fim (também se for cancelada), seguido de refresh e, opcionalmente,
+# force-merge até INGEST_FORCEMERGE_SEGMENTS segmentos (0 = não fazer).
+BULK_LOAD = os.environ.get("INGEST_BULK_LOAD", "0") == "1"
+BULK_FORCEMERGE_SEGMENTS = int(os.environ.get("INGEST_FORCEMERGE_SEGMENTS", "0"))
+
 ES_URL = os.environ.get("ES_URL", "http://localhost:9200")
 INDEX = os.environ.get("ES_INDEX", "files")
 
-# Tesseract path (ajusta se necessário)
-TESSERACT_PATH = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-if os.path.exists(TESSERACT_PATH):
-    pytesseract.pytesseract.tesseract_cmd = TESSERACT_PATH
-
-def ensure_index(es: Elasticsearch, index_name: str):
+def ensure_index(es, index_name: str, partitioned: bool | None = None):
+    """
+    Cria o índice se ainda não existir. Com partições por ano
+    (index_partitions), cria/atualiza o index template das partições, com
+    `index_name` como alias de leitura.
+    """
+    if partitioned is None:
+        partitioned = index_partitions.PARTITION_BY_YEAR
     # Se o índice já existir, não mexe
-    if es.indices.exists(index=index_name):
+    if not partitioned and es.indices.exists(index=index_name):
         return
 
     settings = {
@@ -49,17 +114,93 @@ def ensure_index(es: Elasticsearch, index_name: str):
                     "token_chars": ["letter", "digit"],
                 }
             },
+            "char_filter": {
+                "strip_separators": {
+                    "type": "pattern_replace",
+                    "pattern": "[^0-9A-Za-z]",
+                    "replacement": "",
+                }
+            },
+            "normalizer": {
+                # "FT 2024/123", "ft2024-123" -> "FT2024123"
+                "invoice_normalizer": {
+                    "type": "custom",
+                    "char_filter": ["strip_separators"],
+                    "filter": ["uppercase"],
+                }
+            },
+            "filter": {
+                "pt_light_stemmer": {
+                    "type": "stemmer",
+                    "language": "light_portuguese",
+                }
+            },
             "analyzer": {
                 "edge_analyzer": {
                     "tokenizer": "edge_ngram_tokenizer",
                     "filter": ["lowercase", "asciifolding"],
-                }
+                },
+                # Sugestões (autocomplete): valor inteiro, sem acentos/maiúsculas
+                "suggest_folded": {
+                    "tokenizer": "keyword",
+                    "filter": ["lowercase", "asciifolding"],
+                },
+                # Texto normalizado: sem acentos/maiúsculas + stemming leve (PT).
+                # "Águas" == "aguas", "faturas" == "fatura" sem precisar de fuzziness.
+                "pt_folded": {
+                    "tokenizer": "standard",
+                    "filter": ["lowercase", "asciifolding", "pt_light_stemmer"],
+                },
             },
         }
     }
 
+    folded_text = {"type": "text", "analyzer": "pt_folded"}
+    folded_text_kw = {
+        "type": "text",
+        "analyzer": "pt_folded",
+        "fields": {"keyword": {"type": "keyword", "ignore_above": 256}},
+    }
+
     mappings = {
         "properties": {
+            # Campos de texto com analyzer PT normalizado
+            "texto": folded_text,
+            "filename": folded_text_kw,
+            "entities": {
+                "properties": {
+                    "supplier": folded_text_kw,
+                    "client": folded_text_kw,
+                    # Nº de fatura normalizado: match exato por term e
+                    # pesquisa parcial barata no subcampo wildcard
+                    "invoice_no_norm": {
+                        "type": "keyword",
+                        "normalizer": "invoice_normalizer",
+                        "fields": {"wc": {"type": "wildcard"}},
+                    },
+                }
+            },
+            # Texto por página (para localizar a página do resultado)
+            "page_texts": {
+                "type": "nested",
+                "properties": {
+                    "page": {"type": "integer"},
+                    "text": folded_text,
+                    "conf": {"type": "float"},  # confiança média do OCR
+                },
+            },
+            # Hash do conteúdo: deteta ficheiros repetidos (ex.: uploads)
+            "checksum": {"type": "keyword"},
+            # False = só foi feito OCR das zonas de cabeçalho/rodapé
+            "ocr_complete": {"type": "boolean"},
+            # Texto acima de INGEST_MAX_TEXT_CHARS: truncado ou em continuações
+            "text_truncated": {"type": "boolean"},
+            "part_of": {"type": "keyword"},
+            "part": {"type": "integer"},
+            # Nº de continuações do documento principal
+            "parts": {"type": "integer"},
+            # Autocomplete de fornecedores, clientes e nomes de ficheiro
+            "suggest": {"type": "completion", "analyzer": "suggest_folded"},
             # Campos especiais para pesquisa parcial
             "texto_edge": {
                 "type": "text",
@@ -74,11 +215,148 @@ def ensure_index(es: Elasticsearch, index_name: str):
         }
     }
 
+    if partitioned:
+        index_partitions.ensure_template(es, index_name, settings, mappings)
+        return
     es.indices.create(index=index_name, settings=settings, mappings=mappings)
-    print(f"[INFO] Índice '{index_name}' criado com analyzer edge_ngram.")
+    print(f"[INFO] Índice '{index_name}' criado com analyzers edge_ngram e pt_folded.")
+
+
+_es = None
+
+
+def get_es():
+    """Cliente Elasticsearch (criado no primeiro uso)."""
+    global _es
+    if _es is None:
+        from elasticsearch import Elasticsearch
+
+        _es = Elasticsearch(ES_URL)
+    return _es
+
 
+# ---------------- Carga em massa ----------------
+_bulk_lock = threading.Lock()
+_bulk_depth = 0        # cargas em curso neste processo (só a última repõe)
+_bulk_original = None
 
-es = Elasticsearch(ES_URL)
+
+def _bulk_marker(index_name):
+    # Definições originais guardadas em disco: se o processo morrer a meio,
+    # a próxima carga repõe estas e não o "-1" que ficou no índice
+    return os.path.join(BASE_DIR, ".cache", f"bulk_load_{index_name}.json")
+
+
+# Definições de um índice sem valores próprios (None = por defeito do ES)
+_BULK_DEFAULTS = {"index.refresh_interval": None, "index.number_of_replicas": None}
+
+
+def _bulk_indices(es, index_name):
+    """
+    {índice: definições atuais} dos índices da carga: o índice ou, com
+    partições, as partições atrás do alias (nenhuma depois de um Reset).
+    """
+    flat = es.indices.get_settings(index=index_name, flat_settings=True,
+                                   ignore_unavailable=True, allow_no_indices=True)
+    return {
+        name: {key: body["settings"].get(key) for key in _BULK_DEFAULTS}
+        for name, body in flat.items()
+    }
+
+
+def begin_bulk_load(es, index_name=INDEX):
+    """
+    Desliga o refresh (e as réplicas, se houver) para a carga, em cada
+    partição e no template das partições (as criadas durante a carga herdam
+    o mesmo). Devolve True se a carga ficou ativa; nesse caso
+    end_bulk_load() tem de ser chamado.
+    """
+    global _bulk_depth, _bulk_original
+    with _bulk_lock:
+        if _bulk_depth:
+            _bulk_depth += 1
+            return True
+        marker = _bulk_marker(index_name)
+        partitioned = index_partitions.PARTITION_BY_YEAR
+        try:
+            current = _bulk_indices(es, index_name)
+            try:
+                with open(marker, "r", encoding="utf-8") as fh:
+                    original = json.load(fh)["indices"]
+                print("[BULK] Carga anterior interrompida: a repor as definições guardadas no fim")
+                # Partições criadas depois de a carga anterior ter começado
+                # herdaram o "-1" do template: no fim ficam com os valores por defeito
+                for name in current:
+                    original.setdefault(name, dict(_BULK_DEFAULTS))
+            except (OSError, ValueError, KeyError):
+                original = current
+                os.makedirs(os.path.dirname(marker), exist_ok=True)
+                with open(marker, "w", encoding="utf-8") as fh:
+                    json.dump({"indices": original}, fh)
+
+            for name in current:
+                bulk = {"index.refresh_interval": "-1"}
+                if int(original[name].get("index.number_of_replicas") or 0) > 0:
+                    bulk["index.number_of_replicas"] = 0
+                es.indices.put_settings(index=name, settings=bulk)
+            if partitioned:
+                index_partitions.set_template_settings(
+                    es, index_name, {"refresh_interval": "-1", "number_of_replicas": 0}
+                )
+        except Exception as e:
+            print(f"[WARN] Modo de carga em massa indisponível: {e}")
+            return False
+        _bulk_depth = 1
+        _bulk_original = original
+        print(f"[BULK] Carga em massa ativa em {index_name} ({len(current)} índice(s))")
+        return True
+
+
+def end_bulk_load(es, index_name=INDEX):
+    """
+    Repõe as definições originais de cada índice (as partições novas ficam
+    com os valores por defeito) e do template, faz refresh e (opcional)
+    force-merge.
+    """
+    global _bulk_depth, _bulk_original
+    with _bulk_lock:
+        _bulk_depth -= 1
+        if _bulk_depth > 0:
+            return
+        original, _bulk_original = _bulk_original, None
+        if index_partitions.PARTITION_BY_YEAR:
+            index_partitions.set_template_settings(
+                es, index_name, {"refresh_interval": None, "number_of_replicas": None}
+            )
+        names = list(_bulk_indices(es, index_name))
+        for name in names:
+            # None repõe o valor por defeito do Elasticsearch
+            es.indices.put_settings(index=name, settings=original.get(name, _BULK_DEFAULTS))
+        try:
+            os.remove(_bulk_marker(index_name))
+        except OSError:
+            pass
+    print(f"[BULK] Definições repostas em {index_name} ({len(names)} índice(s))")
+    if not names:
+        return
+    es.indices.refresh(index=index_name)
+    if BULK_FORCEMERGE_SEGMENTS > 0:
+        t0 = time.perf_counter()
+        es.options(request_timeout=3600).indices.forcemerge(
+            index=index_name, max_num_segments=BULK_FORCEMERGE_SEGMENTS
+        )
+        print(f"[BULK] Force-merge ({BULK_FORCEMERGE_SEGMENTS} segmento(s)) em {time.perf_counter() - t0:.1f}s")
+
+
+def bulk_load_active():
+    return _bulk_depth > 0
+
+
+def throughput_summary(count, elapsed, bulk=False):
+    """Linha de resumo: documentos, tempo e documentos por segundo."""
+    rate = count / elapsed if elapsed > 0 else 0.0
+    mode = ", carga em massa" if bulk else ""
+    return f"{count} documento(s) em {elapsed:.1f}s ({rate:.2f} docs/s{mode})"
 
 
 # ---------------- Utils ----------------
@@ -90,11 +368,29 @@ def strip_accents(text: str) -> str:
     return "".join(c for c in normalized if not unicodedata.combining(c))
 
 
+def normalize_invoice_no(value: str) -> str:
+    """Nº de fatura sem separadores nem minúsculas: 'FT 2024/123' -> 'FT2024123'."""
+    return re.sub(r"[^0-9A-Z]", "", strip_accents(value or "").upper())
+
+
 def make_doc_id(path: str) -> str:
     abspath = os.path.abspath(path)
     return hashlib.sha256(abspath.encode("utf-8", errors="ignore")).hexdigest()
 
 
+def file_sha256(path: str) -> str | None:
+    """SHA-256 do conteúdo do ficheiro (lido aos blocos)."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                digest.update(chunk)
+    except Exception as e:
+        print(f"[WARN] Falha ao calcular checksum de {path}: {e}")
+        return None
+    return digest.hexdigest()
+
+
 def safe_filesize(path: str) -> int:
     try:
         return os.path.getsize(path)
@@ -152,90 +448,237 @@ def normalize_date_for_es(date_str: str) -> str | None:
 
 # ---------------- Extraction ----------------
 def extract_text_with_tika(path):
+    # Em modo "truncate" não vale a pena receber mais texto do que o limite
+    max_chars = MAX_TEXT_CHARS if TEXT_OVERFLOW != "split" else None
     try:
-        parsed = parser.from_file(path, serverEndpoint="http://localhost:9998/tika")
-        return (parsed.get("content", "") or "").strip()
+        return tika_client.extract_text(path, max_chars=max_chars)
+    except tika_client.TikaUnavailable:
+        return ""
     except Exception as e:
         print(f"[WARN] Tika falhou para {path}: {e}")
         return ""
 
 
-def tesseract_text(pil_img):
-    gray = pil_img.convert("L")
-    return pytesseract.image_to_string(
-        gray,
-        lang="por+eng",
-        config="--oem 3 --psm 6 --dpi 300",
-    ).strip()
+def tesseract_text(pil_img, profile="scan"):
+    """OCR de uma imagem, depois do pré-processamento do perfil dado."""
+    from parsers import image_preprocess
+
+    img = image_preprocess.preprocess(pil_img, profile)
+    dpi = image_preprocess.profile_dpi(profile)
+    return ocr_engine.get_engine().image_to_text(img, dpi=dpi, psm=6)
+
+
+def ocr_ladder(render, profile="scan"):
+    """
+    OCR com escada de qualidade. `render(dpi)` devolve a imagem da página
+    ao DPI pedido. Devolve (texto, confiança) do melhor degrau tentado.
+    """
+    from parsers import image_preprocess
+
+    engine = ocr_engine.get_engine()
+    best_text, best_conf = "", -1.0
+    for dpi, psm in OCR_LADDER:
+        img = image_preprocess.preprocess(render(dpi), profile, dpi=dpi)
+        text, conf = engine.image_to_data(img, dpi=dpi, psm=psm)
+        if conf > best_conf:
+            best_text, best_conf = text, conf
+        if conf >= OCR_MIN_CONF:
+            break
+    return best_text.strip(), (round(best_conf, 1) if best_conf >= 0 else None)
+
+
+def mean_confidence(confs):
+    """Confiança média do documento (páginas com OCR)."""
+    values = [c for c in confs or [] if c is not None]
+    return round(sum(values) / len(values), 1) if values else None
 
 
-def ocr_pdf(path):
-    text = ""
+def page_text_entries(page_texts, page_confs=None):
+    """Entradas do campo nested page_texts (páginas sem texto ficam de fora)."""
+    entries = []
+    for i, t in enumerate(page_texts, start=1):
+        if not t or not t.strip():
+            continue
+        entry = {"page": i, "text": t.strip()}
+        if page_confs and page_confs[i - 1] is not None:
+            entry["conf"] = page_confs[i - 1]
+        entries.append(entry)
+    return entries
+
+
+def ocr_pdf_regions(path):
+    """
+    OCR rápido: faixas de cabeçalho e rodapé da 1ª e da última página.
+    Devolve (texto, textos_por_página) com "" nas páginas não lidas, ou
+    None se as zonas não tiverem nenhuma entidade (fazer OCR completo).
+    """
+    import pypdfium2
+    from parsers import image_preprocess
+
+    profile = image_preprocess.profile_for(".pdf")
+    scale = image_preprocess.pdf_render_scale(profile)
+    pdf_doc = pypdfium2.PdfDocument(path)
     try:
-        # 1) tentar texto nativo com pdfplumber
-        with pdfplumber.open(path) as pdf:
-            native = "\n".join(page.extract_text() or "" for page in pdf.pages)
-        if native.strip():
-            return native, "pdfplumber", len(native) / 10000.0  # métrica fake
+        n = len(pdf_doc)
+        page_texts = [""] * n
+        for idx in sorted({0, n - 1}):
+            page = pdf_doc[idx]
+            try:
+                pil = page.render(scale=scale).to_pil()
+            finally:
+                page.close()
+            band = int(pil.height * OCR_ROI_BAND)
+            parts = [tesseract_text(pil.crop((0, 0, pil.width, band)), profile)]
+            if band < pil.height - band:
+                parts.append(tesseract_text(pil.crop((0, pil.height - band, pil.width, pil.height)), profile))
+            page_texts[idx] = "\n".join(p for p in parts if p)
+    finally:
+        pdf_doc.close()
+
+    text = "\n".join(t for t in page_texts if t).strip()
+    found = extract_entities(text)
+    if not any(found.get(k) for k in ("nif", "invoice_no", "total")):
+        return None
+    return text, page_texts
+
+
+def ocr_pdf(path, fast=None, collector=None, has_native=None):
+    """
+    Devolve (texto, engine, conf, textos_por_página, confiança_por_página).
+    Com fast (por defeito OCR_MODE=fast) tenta primeiro o OCR das zonas
+    (engine ROI_ENGINE); o texto fica incompleto até ao OCR completo.
+    As páginas passam por `collector` (TextCollector), que limita o texto.
+    `has_native`: se o PDF tem texto nativo, quando quem chama já o leu
+    (None: verificar aqui).
+    """
+    if collector is None:
+        collector = TextCollector()
 
-        # 2) se não houver texto, fazer OCR página a página
+    def result(engine):
+        return collector.text, engine, collector.mean_conf, collector.page_texts, collector.page_confs
+
+    import pypdfium2
+    from parsers import image_preprocess
+
+    if fast is None:
+        fast = OCR_MODE == "fast"
+    try:
+        # 1) tentar texto nativo com pdfplumber
+        if has_native is None:
+            with closing(iter_pdf_native_pages(path)) as native:
+                has_native = any(native)
+        if has_native:
+            for text in iter_pdf_native_pages(path):
+                collector.add(text)
+            return result("pdfplumber")
+
+        # 2) OCR rápido das zonas com entidades
+        if fast:
+            regions = ocr_pdf_regions(path)
+            if regions:
+                print("[OCR] Zonas de cabeçalho/rodapé:", os.path.basename(path))
+                for text in regions[1]:
+                    collector.add(text)
+                return result(ROI_ENGINE)
+
+        # 3) se não houver texto, fazer OCR página a página (escada de qualidade)
+        profile = image_preprocess.profile_for(".pdf")
         pdf_doc = pypdfium2.PdfDocument(path)
-        for page in pdf_doc:
-            pil = page.render(scale=2.0).to_pil()
-            text += "\n" + tesseract_text(pil)
-        if text.strip():
+        try:
+            for page in pdf_doc:
+                text, conf = ocr_ladder(lambda dpi: page.render(scale=dpi / 72.0).to_pil(), profile)
+                collector.add(text, conf)
+                page.close()
+        finally:
+            pdf_doc.close()
+        if collector.text:
             print("[OCR] Texto extraído via Tesseract:", os.path.basename(path))
-        return text.strip(), "tesseract", None
+        return result("tesseract")
     except Exception as e:
         print(f"[WARN] OCR PDF falhou para {path}: {e}")
-        return "", "tesseract", None
+        return "", "tesseract", None, None, None
 
 
 def ocr_image(path):
+    from PIL import Image
+    from parsers import image_preprocess
+
     try:
         image = Image.open(path)
-        text = tesseract_text(image)
+        profile = image_preprocess.profile_for(os.path.splitext(path)[1])
+        text, conf = ocr_ladder(lambda dpi: image, profile)
         if text:
             print("[OCR] Texto extraído de", os.path.basename(path))
-        return text.strip(), "tesseract", None
+        return text.strip(), "tesseract", conf
     except Exception as e:
         print(f"[WARN] OCR de imagem falhou para {path}: {e}")
         return "", "tesseract", None
 
 
+def extract_spreadsheet(path):
+    """
+    Devolve (texto, engine, folhas) de .xlsx/.xls lidos localmente, linha a
+    linha (sem ida e volta ao Tika). Se a leitura nativa falhar, usa o Tika.
+    """
+    try:
+        result = parse_spreadsheet(path)
+        if result["truncated"]:
+            print(f"[WARN] Folha de cálculo truncada (limite de células): {os.path.basename(path)}")
+        return result["text"], result["engine"], result["sheets"]
+    except Exception as e:
+        print(f"[WARN] Leitura nativa falhou para {path}: {e}; a usar Tika")
+        return extract_text_with_tika(path), "tika", None
+
+
+def iter_pdf_native_pages(path):
+    """Texto nativo (pdfplumber) página a página, libertando cada página depois de lida."""
+    import pdfplumber
+
+    with pdfplumber.open(path) as pdf:
+        for page in pdf.pages:
+            try:
+                yield re.sub(r"[ \t]+", " ", page.extract_text() or "").strip()
+            finally:
+                page.close()
+
+
 def extract_pdf_text_plain(path):
     """
-    Devolve (texto, engine, nº páginas, conf_aprox)
-    Tenta: pdfplumber -> Tika -> OCR
+    Devolve (TextCollector, engine, nº páginas).
+    Tenta: pdfplumber -> Tika -> OCR, sempre página a página, com o texto
+    limitado a MAX_TEXT_CHARS e as entidades detetadas à medida que se lê.
+    Com o Tika não há separação por páginas (collector.paged = False).
     """
     pages = 0
+    has_native = None
 
     # a) pdfplumber (texto nativo)
+    collector = TextCollector()
     try:
-        with pdfplumber.open(path) as pdf:
-            pages = len(pdf.pages)
-            parts = []
-            for page in pdf.pages:
-                t = page.extract_text() or ""
-                t = re.sub(r"[ \t]+", " ", t)
-                parts.append(t.strip())
-            text = "\n\n".join(p for p in parts if p).strip()
-            if len(text) > 40:
-                return text, "pdfplumber", pages, len(text) / 10000.0
+        for text in iter_pdf_native_pages(path):
+            collector.add(text)
+        pages = collector.page_count
+        if collector.size > 40:
+            return collector, "pdfplumber", pages
+        has_native = collector.size > 0
     except Exception as e:
         print(f"[WARN] pdfplumber falhou para {path}: {e}")
+    collector.discard()
 
     # b) Tika
     try:
         t2 = extract_text_with_tika(path)
         if len(t2) > 40:
-            return t2, "tika", pages or None, len(t2) / 10000.0
+            collector = TextCollector(paged=False)
+            collector.add(t2)
+            return collector, "tika", pages or None
     except Exception:
         pass
 
     # c) OCR
-    t3, engine, conf = ocr_pdf(path)
-    return t3, engine, pages or None, conf
+    collector = TextCollector()
+    _, engine, _, _, _ = ocr_pdf(path, collector=collector, has_native=has_native)
+    return collector, engine, pages or None
 
 
 # ---------------- Entities ----------------
@@ -285,16 +728,20 @@ def extract_entities(text):
     if found_totals:
         entities["total"] = max(found_totals)
 
-    # Nº de fatura
+    # Nº de fatura (com a série: "FT 2024/123", para o invoice_no_norm
+    # coincidir com o que o utilizador escreve na pesquisa)
     invoice_patterns = [
+        r"\b((?:FT|FA|FR|NC|ND)[:\s\/-]*\d{4}[\/-]\d+)",
         r"Fatura\s*(?:n\.?|nº|#)\s*([A-Za-z0-9\-\/]+)",
-        r"(?:FT|FA|FR|NC|ND)[:\s\/-]*(\d{4}[\/-]\d+)",
         r"(?:Invoice|Doc)[:\s]*([A-Za-z0-9\-\/]+)",
     ]
     for pattern in invoice_patterns:
         inv_match = re.search(pattern, text, re.I)
         if inv_match:
             entities["invoice_no"] = inv_match.group(1).strip()
+            norm = normalize_invoice_no(entities["invoice_no"])
+            if norm:
+                entities["invoice_no_norm"] = norm
             break
 
     # Moeda
@@ -338,8 +785,183 @@ def extract_entities(text):
     return entities
 
 
+# ---------------- Texto limitado ----------------
+class TextCollector:
+    """
+    Junta o texto de um documento página a página, sem passar de
+    MAX_TEXT_CHARS, e deteta as entidades à medida que as páginas chegam
+    (extract_entities por página, combinadas como se fosse o texto todo).
+    O texto a mais é descartado ou, com INGEST_TEXT_OVERFLOW=split, escrito
+    em blocos num ficheiro temporário (spool_path) para as continuações.
+    """
+
+    def __init__(self, max_chars=MAX_TEXT_CHARS, overflow=TEXT_OVERFLOW, paged=True):
+        self.max_chars = max_chars
+        self.overflow = overflow
+        self.paged = paged
+        self.page_texts = []   # páginas guardadas no documento principal
+        self.page_confs = []
+        self.page_count = 0
+        self.size = 0
+        self.truncated = False
+        self.parts = 0
+        self.spool_path = None
+        self._chunk = []
+        self._chunk_size = 0
+        self._entities = {}
+        self._nifs = []
+        self._totals = []
+
+    # -- entidades --
+    def _feed_entities(self, text):
+        found = extract_entities(text)
+        for nif in (found.pop("nif", None), found.pop("client_nif", None)):
+            if nif and len(self._nifs) < 2:
+                self._nifs.append(nif)
+        total = found.pop("total", None)
+        if total is not None:
+            self._totals.append(total)
+        for key, value in found.items():
+            self._entities.setdefault(key, value)
+
+    @property
+    def entities(self) -> dict:
+        entities = dict(self._entities)
+        if self._nifs:
+            entities["nif"] = self._nifs[0]
+            if len(self._nifs) > 1:
+                entities["client_nif"] = self._nifs[1]
+        if self._totals:
+            entities["total"] = max(self._totals)
+        return entities
+
+    # -- texto --
+    def add(self, text, conf=None):
+        text = text or ""
+        self.page_count += 1
+        if text:
+            self._feed_entities(text)
+
+        room = self.max_chars - self.size
+        if not self.truncated:
+            kept = text[:max(room, 0)]
+            self.page_texts.append(kept)
+            self.page_confs.append(conf)
+            self.size += len(kept)
+            text = text[len(kept):]
+            if not text:
+                return
+            self.truncated = True
+        if self.overflow != "split":
+            return
+        # Páginas enormes (ou texto do Tika sem páginas) são partidas em blocos
+        for start in range(0, len(text), self.max_chars):
+            piece = text[start:start + self.max_chars]
+            self._chunk.append({"page": self.page_count, "text": piece, "conf": conf})
+            self._chunk_size += len(piece)
+            if self._chunk_size >= self.max_chars:
+                self._flush_chunk()
+
+    def _flush_chunk(self):
+        if not self._chunk:
+            return
+        if self.spool_path is None:
+            fd, self.spool_path = tempfile.mkstemp(prefix="docsearch_parts_", suffix=".jsonl")
+            os.close(fd)
+        with open(self.spool_path, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(self._chunk, ensure_ascii=False) + "\n")
+        self.parts += 1
+        self._chunk = []
+        self._chunk_size = 0
+
+    def finish(self):
+        self._flush_chunk()
+        return self
+
+    def discard(self):
+        """Apaga o spool (tentativa de extração abandonada)."""
+        if self.spool_path:
+            try:
+                os.remove(self.spool_path)
+            except OSError:
+                pass
+            self.spool_path = None
+
+    @property
+    def text(self) -> str:
+        sep = "\n\n" if self.paged else ""
+        return sep.join(t for t in self.page_texts if t).strip()
+
+    @property
+    def mean_conf(self):
+        return mean_confidence(self.page_confs)
+
+
+def iter_continuations(spool_path):
+    """Blocos de páginas (listas de {page, text, conf}) do spool, um de cada vez."""
+    with open(spool_path, "r", encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                yield json.loads(line)
+
+
 # ---------------- Index ----------------
-def index_file(path):
+def build_suggest(entities: dict, filename: str) -> list:
+    """Entradas do campo completion: entidades pesam mais que nomes de ficheiro."""
+    names = []
+    for key in ("supplier", "client"):
+        value = (entities.get(key) or "").strip()[:100]
+        if value and value not in names:
+            names.append(value)
+    stem = os.path.splitext(filename)[0].strip()[:100]
+
+    suggest = []
+    if names:
+        suggest.append({"input": names, "weight": 10})
+    if stem:
+        suggest.append({"input": [stem], "weight": 1})
+    return suggest
+
+
+def derived_fields(entities: dict, texto: str, filename: str) -> dict:
+    """
+    Campos calculados a partir das entidades e do texto (analítico, tipo de
+    documento, autocomplete). Usado pelo build_document e pelo OCR completo,
+    para os dois darem sempre o mesmo resultado. Acerta também
+    entities["invoice_no_norm"].
+    """
+    if entities.get("invoice_no"):
+        norm = normalize_invoice_no(entities["invoice_no"])
+        if norm:
+            entities["invoice_no_norm"] = norm
+        else:
+            entities.pop("invoice_no_norm", None)
+
+    # Analítico a partir da data
+    if entities.get("date"):
+        y, m, q = ymq_from_date(entities["date"])
+    else:
+        y, m, q = None, None, None
+
+    # Palavra-chave simples do fornecedor (primeira palavra, sem grande lógica)
+    supplier_kw = None
+    if entities.get("supplier"):
+        supplier_kw = entities["supplier"].split(",")[0].split(" ")[0][:40]
+
+    return {
+        "document_type": "Fatura"
+        if re.search(r"\bFatura\b", texto or "", re.I)
+        else None,
+        "year": y,
+        "month": m,
+        "quarter": q,
+        "supplier_keyword": supplier_kw,
+        "suggest": build_suggest(entities, filename),
+    }
+
+
+def build_document(path):
+    """Extrai o texto e as entidades de um ficheiro e devolve o documento a indexar."""
     t0 = time.perf_counter()
     fid = make_doc_id(path)
     ext = os.path.splitext(path)[1].lower()
@@ -347,29 +969,47 @@ def index_file(path):
     pages = None
     engine = None
     conf = None
-
-    # Se estiver em modo "só novos" e o ID já existir, salta
-    if NEW_ONLY:
-        try:
-            if es.exists(index=INDEX, id=fid):
-                print("SKIP (já indexado):", os.path.basename(path))
-                return
-        except Exception as e:
-            print(f"[WARN] Falha ao verificar existencia em ES para {path}: {e}")
+    page_texts = None
+    page_confs = None
+    sheets = None
 
     # Extração de texto
+    collector = None
     if ext == ".pdf":
-        texto, engine, pages, conf = extract_pdf_text_plain(path)
+        collector, engine, pages = extract_pdf_text_plain(path)
     elif ext in [".png", ".jpg", ".jpeg", ".tiff", ".tif"]:
         texto = extract_text_with_tika(path)
         engine = "tika"
         if not texto.strip():
             texto, engine, conf = ocr_image(path)
+    elif ext in [".xlsx", ".xls"]:
+        texto, engine, sheets = extract_spreadsheet(path)
     else:
         texto = extract_text_with_tika(path)
         engine = "tika"
 
-    entities = extract_entities(texto or "")
+    if collector is None:
+        collector = TextCollector(paged=False)
+        collector.add(texto or "", conf)
+    collector.finish()
+    texto = collector.text
+    conf = collector.mean_conf
+    if collector.paged:
+        page_texts, page_confs = collector.page_texts, collector.page_confs
+    entities = collector.entities
+    if collector.truncated:
+        print(f"[WARN] Texto acima de {MAX_TEXT_CHARS} caracteres ({TEXT_OVERFLOW}): {os.path.basename(path)}")
+
+    # Folhas de cálculo: NIFs/totais vêm das células, mais fiáveis que o regex no texto
+    if sheets:
+        sheet_nifs = [n for sh in sheets for n in sh["nifs"]]
+        sheet_totals = [t for sh in sheets for t in sh["totals"] if t > 0]
+        if sheet_nifs:
+            entities["nif"] = sheet_nifs[0]
+            if len(sheet_nifs) > 1:
+                entities["client_nif"] = sheet_nifs[1]
+        if sheet_totals:
+            entities["total"] = max(sheet_totals)
 
     # --- NORMALIZAR DATA PARA ELASTICSEARCH ---
     norm_date = None
@@ -382,17 +1022,6 @@ def index_file(path):
             print(f"[WARN] Data não reconhecida em {os.path.basename(path)}: {entities['date']!r}")
             entities.pop("date", None)
 
-    # Analítico a partir da data
-    if entities.get("date"):
-        y, m, q = ymq_from_date(entities["date"])
-    else:
-        y, m, q = None, None, None
-
-    # Palavra-chave simples do fornecedor (primeira palavra, sem grande lógica)
-    supplier_kw = None
-    if entities.get("supplier"):
-        supplier_kw = entities["supplier"].split(",")[0].split(" ")[0][:40]
-
     processing_ms = int((time.perf_counter() - t0) * 1000)
 
     filename = os.path.basename(path)
@@ -412,68 +1041,449 @@ def index_file(path):
         # Documental
         "pages": pages,
         "file_size": safe_filesize(path),
-        "checksum": fid,
+        "checksum": file_sha256(path),  # SHA-256 do conteúdo (deduplicação)
         "source_system": None,
-        "document_type": "Fatura"
-        if re.search(r"\bFatura\b", texto_final or "", re.I)
-        else None,
         # Processo
         "ocr_engine": engine,
         "ocr_confidence": conf,
+        "ocr_complete": engine != ROI_ENGINE,
+        "text_truncated": collector.truncated,
         "processing_time_ms": processing_ms,
         "error_log": None,
-        # Analítico
-        "year": y,
-        "month": m,
-        "quarter": q,
-        "supplier_keyword": supplier_kw,
         "category": None,
+        # Analítico (ano/mês/trimestre), document_type, autocomplete
+        **derived_fields(entities, texto_final, filename),
     }
 
+    # Continuações (INGEST_TEXT_OVERFLOW=split): indexadas à parte por index_file
+    doc["parts"] = collector.parts
+    if collector.spool_path:
+        doc["_parts_spool"] = collector.spool_path
+
+    # Resumo por folha (folhas de cálculo)
+    if sheets:
+        doc["sheets"] = sheets
+
+    # Texto por página (nested): permite abrir o resultado na página certa
+    if PAGE_TEXT_INDEX and page_texts:
+        doc["page_texts"] = page_text_entries(page_texts, page_confs)
+
 
 
+    # Miniatura da 1ª página gerada já na indexação (opcional)
+    if PREVIEW_PREGEN and doc["checksum"] and ext in previews.PREVIEW_EXTS:
+        try:
+            previews.get_preview(path, 1, previews.DEFAULT_WIDTH)
+        except Exception as e:
+            print(f"[WARN] Falha ao gerar miniatura de {path}: {e}")
+
+    return doc
+
+
+def failed_document(path, error):
+    """Documento mínimo (nome, caminho, error_log) para um ficheiro cuja extração falhou."""
+    filename = os.path.basename(path)
+    return {
+        "id": make_doc_id(path),
+        "filename": filename,
+        "filename_edge": filename,
+        "extension": os.path.splitext(path)[1].lower().replace(".", ""),
+        "path": os.path.abspath(path),
+        "texto": "",
+        "entities": {},
+        "indexed_at": datetime.utcnow().isoformat(),
+        "file_size": safe_filesize(path),
+        "checksum": file_sha256(path),
+        "error_log": error,
+        "parts": 0,
+        "suggest": build_suggest({}, filename),
+    }
+
+
+def is_indexed(path):
+    """True se o ficheiro já tem documento no índice (modo "só novos")."""
     try:
-        es.index(index=INDEX, id=fid, document=doc)
-        print("INDEXED:", os.path.basename(path))
+        if index_partitions.PARTITION_BY_YEAR:
+            # GET por id não funciona num alias com várias partições
+            res = get_es().count(index=INDEX, query={"ids": {"values": [make_doc_id(path)]}})
+            return res["count"] > 0
+        return bool(get_es().exists(index=INDEX, id=make_doc_id(path)))
+    except Exception as e:
+        print(f"[WARN] Falha ao verificar existencia em ES para {path}: {e}")
+        return False
+
+
+def index_file(path, new_only=None):
+    """
+    Extrai, enriquece e indexa um ficheiro.
+    Com INGEST_ISOLATION=1 a extração corre num processo à parte, com
+    limites de tempo e memória (ingest_sandbox); se falhar, indexa-se só o
+    nome com o erro em error_log e o ficheiro vai para a fila de repetição.
+    Devolve "indexed", "skipped" (já indexado, modo só novos), "failed" ou "error".
+    """
+    import ingest_sandbox
+
+    if new_only is None:
+        new_only = NEW_ONLY
+
+    # Se estiver em modo "só novos" e o ID já existir, salta
+    if new_only and is_indexed(path):
+        print("SKIP (já indexado):", os.path.basename(path))
+        return "skipped"
+
+    status = "indexed"
+    try:
+        if ingest_sandbox.INGEST_ISOLATION:
+            doc = ingest_sandbox.get_sandbox().build(path)
+        else:
+            doc = build_document(path)
+    except Exception as e:
+        print(f"[ERROR] Extração falhou para {path}: {e}")
+        ingest_sandbox.add_to_retry_queue(path, str(e))
+        doc = failed_document(path, str(e))
+        status = "failed"
+    spool = doc.pop("_parts_spool", None)
+
+    try:
+        # Em modo "só novos" já se sabe que não há cópia indexada
+        return index_document(path, doc, status, iter_continuations(spool) if spool else (),
+                              known_new=new_only)
+    finally:
+        if spool:
+            try:
+                os.remove(spool)
+            except OSError:
+                pass
+
+
+def index_remote_result(path, result, spool=None):
+    """
+    Indexa o resultado enviado por um worker remoto (`ingest.py --worker`):
+    {"doc": ...} ou {"error": "..."}. As continuações chegam à parte, em
+    lotes, e ficam em `spool` (como o do TextCollector).
+    O id e o caminho são sempre os do coordenador.
+    """
+    import ingest_sandbox
+
+    if result.get("error"):
+        print(f"[ERROR] Extração remota falhou para {path}: {result['error']}")
+        ingest_sandbox.add_to_retry_queue(path, result["error"])
+        return index_document(path, failed_document(path, result["error"]), "failed")
+
+    doc = dict(result["doc"])
+    doc.pop("_parts_spool", None)
+    doc["id"] = make_doc_id(path)
+    doc["path"] = os.path.abspath(path)
+    return index_document(path, doc, "indexed", iter_continuations(spool) if spool else ())
+
+
+def indexed_copy(es, fid):
+    """
+    (índice, nº de continuações) da cópia já indexada de um documento, ou
+    None se não houver. O nº é None em documentos indexados antes do campo
+    `parts` existir.
+    """
+    if not index_partitions.PARTITION_BY_YEAR:
+        res = es.options(ignore_status=404).get(index=INDEX, id=fid, _source_includes=["parts"])
+        if not res.get("found"):
+            return None
+        return res["_index"], res["_source"].get("parts")
+    # GET por id não funciona num alias com várias partições
+    hits = es.search(index=INDEX, query={"ids": {"values": [fid]}},
+                     _source=["parts"], size=1)["hits"]["hits"]
+    if not hits:
+        return None
+    return hits[0]["_index"], hits[0]["_source"].get("parts")
+
+
+def index_document(path, doc, status="indexed", parts=(), known_new=False):
+    """
+    Indexa um documento já construído e, em modo "split", as continuações
+    (`parts`: blocos de páginas, como em iter_continuations). `known_new`:
+    o documento ainda não está no índice (salta a procura da cópia antiga).
+    Devolve `status` ou "error".
+    """
+    target = index_partitions.write_index(INDEX, doc.get("year"))
+    try:
+        es = get_es()
+        previous = None if known_new else indexed_copy(es, doc["id"])
+        es.index(index=target, id=doc["id"], document=doc)
+        if target != INDEX and previous and previous[0] != target:
+            # O ano mudou: apagar a cópia na partição antiga
+            es.options(ignore_status=404).delete(index=previous[0], id=doc["id"])
+        if TEXT_OVERFLOW == "split":
+            index_continuations(doc["id"], doc, parts, target, previous)
+        print("INDEXED:" if status == "indexed" else "FAILED:", os.path.basename(path))
+        entities = doc.get("entities")
         if entities:
             print(
                 "   Entidades:",
                 ", ".join([f"{k}={v}" for k, v in entities.items() if v]),
             )
+        return status
     except Exception as e:
         print(f"[ERROR] Falhou ao indexar {path}: {e}")
+        return "error"
 
 
-def walk_and_index(folder):
-    supported = [".pdf", ".png", ".jpg", ".jpeg", ".tiff", ".tif", ".xlsx", ".xls"]
-    count = 0
+def index_continuations(fid, doc, chunks, index_name=INDEX, previous=None):
+    """
+    Indexa os documentos de continuação (<id>_p1, <id>_p2, ...), um bloco de
+    páginas de cada vez, no índice do documento (`index_name`). `previous`
+    é a cópia anterior (indexed_copy): só se apagam continuações antigas
+    se antes havia mais, ou se estavam noutra partição.
+    """
+    es = get_es()
+    parts = 0
+    for parts, chunk in enumerate(chunks, start=1):
+        text = "\n\n".join(p["text"] for p in chunk if p["text"]).strip()
+        part = {
+            "id": f"{fid}_p{parts}",
+            "part_of": fid,
+            "part": parts,
+            "filename": doc["filename"],
+            "filename_edge": doc["filename"],
+            "extension": doc.get("extension"),
+            "path": doc["path"],
+            "texto": text,
+            "texto_edge": text,
+            "language": doc.get("language"),
+            "indexed_at": doc.get("indexed_at"),
+            "checksum": doc.get("checksum"),
+            "ocr_engine": doc.get("ocr_engine"),
+        }
+        if PAGE_TEXT_INDEX:
+            part["page_texts"] = [
+                {k: v for k, v in p.items() if v is not None}
+                for p in chunk if p["text"].strip()
+            ]
+        es.index(index=index_name, id=part["id"], document=part)
+    if parts:
+        print(f"   Continuações: {parts}")
+    if previous is None:
+        return
+    old_index, old_parts = previous
+    if old_parts is not None and old_parts <= (parts if old_index == index_name else 0):
+        return
+    query = {"bool": {"filter": [{"term": {"part_of": fid}}]}}
+    if old_index == index_name:
+        query["bool"]["filter"].append({"range": {"part": {"gt": parts}}})
+    # Noutra partição (o ano mudou) apagam-se todas as continuações antigas
+    es.delete_by_query(index=old_index, query=query, conflicts="proceed")
+
+
+def list_pending_ocr():
+    """
+    [(id, _source, índice)] dos PDFs indexados em modo rápido
+    (ocr_complete = false). A lista é lida toda de uma vez: o OCR completo
+    demora minutos por documento e o scroll expirava a meio.
+    """
+    from elasticsearch import helpers
+
+    query = {"bool": {"filter": [{"term": {"ocr_complete": False}}]}}
+    return [
+        (hit["_id"], hit["_source"], hit["_index"])
+        for hit in helpers.scan(get_es(), index=INDEX, query={"query": query},
+                                _source=["path", "filename", "extension", "language", "indexed_at",
+                                         "checksum", "entities", "parts"])
+    ]
+
+
+def complete_ocr_doc(fid, src, index_name=INDEX):
+    """
+    OCR completo de um documento indexado em modo rápido. Atualiza o texto;
+    as entidades das zonas mantêm-se e só se acrescentam as que faltavam.
+    O texto passa por um TextCollector como no build_document (limite,
+    entidades página a página, continuações em modo "split"), e os campos
+    calculados (ano, tipo, suggest, ...) são recalculados; se o ano mudar,
+    o documento passa para a partição certa.
+    Devolve "indexed", "skipped" ou "error".
+    """
+    path = src.get("path")
+    if not path or not os.path.isfile(path):
+        print(f"[WARN] Ficheiro não encontrado: {path}")
+        return "skipped"
+    collector = TextCollector()
+    try:
+        _, engine, _, _, _ = ocr_pdf(path, fast=False, collector=collector)
+        collector.finish()
+        text = collector.text
+        if not text:
+            return "skipped"
+        if collector.truncated:
+            print(f"[WARN] Texto acima de {MAX_TEXT_CHARS} caracteres ({TEXT_OVERFLOW}): {os.path.basename(path)}")
+        entities = dict(src.get("entities") or {})
+        for key, value in collector.entities.items():
+            if key == "date":
+                value = normalize_date_for_es(value)
+            if value and not entities.get(key):
+                entities[key] = value
+        update = {
+            "texto": text,
+            "texto_edge": text,
+            "entities": entities,
+            "ocr_engine": engine,
+            "ocr_confidence": collector.mean_conf,
+            "ocr_complete": True,
+            "text_truncated": collector.truncated,
+            "parts": collector.parts,
+            **derived_fields(entities, text, src.get("filename") or os.path.basename(path)),
+        }
+        if PAGE_TEXT_INDEX and collector.page_texts:
+            update["page_texts"] = page_text_entries(collector.page_texts, collector.page_confs)
+        target = index_partitions.write_index(INDEX, update["year"])
+
+        es = get_es()
+        if target != index_name:
+            # O ano mudou: o documento muda de partição
+            doc = es.get(index=index_name, id=fid)["_source"]
+            doc.update(update)
+            es.index(index=target, id=fid, document=doc)
+            es.delete(index=index_name, id=fid)
+        else:
+            doc = {"filename": os.path.basename(path), **src, **update}
+            es.update(index=index_name, id=fid, doc=update)
+        if TEXT_OVERFLOW == "split":
+            spool = collector.spool_path
+            index_continuations(fid, doc, iter_continuations(spool) if spool else (), target,
+                                previous=(index_name, src.get("parts")))
+        print("OCR COMPLETO:", os.path.basename(path))
+        return "indexed"
+    except Exception as e:
+        print(f"[ERROR] Falhou ao atualizar {path}: {e}")
+        return "error"
+    finally:
+        collector.discard()
+
+
+def complete_pending_ocr(should_stop=None):
+    """
+    OCR completo dos PDFs indexados em modo rápido (ocr_complete = false).
+    `should_stop()` permite parar entre documentos.
+    """
+    pending = list_pending_ocr()
+    print(f"[OCR] Documentos com OCR incompleto: {len(pending)}")
+
+    done = 0
+    for fid, src, index_name in pending:
+        if should_stop and should_stop():
+            break
+        if complete_ocr_doc(fid, src, index_name) == "indexed":
+            done += 1
+    return done
+
+
+def iter_supported_files(folder):
+    """Caminhos dos ficheiros suportados dentro da pasta (recursivo)."""
     for root, _, files in os.walk(folder):
         for f in files:
-            if any(f.lower().endswith(ext) for ext in supported):
-                full = os.path.join(root, f)
-                index_file(full)
-                count += 1
+            if any(f.lower().endswith(ext) for ext in SUPPORTED_EXTS):
+                yield os.path.join(root, f)
+
+
+def index_path(full, new_only=None):
+    """index_file() com verificação prévia; None se o caminho não é um ficheiro suportado."""
+    if not os.path.isfile(full):
+        print(f"[WARN] Ficheiro não encontrado: {full}")
+        return None
+    if not any(full.lower().endswith(ext) for ext in SUPPORTED_EXTS):
+        return None
+    return index_file(full, new_only=new_only)
+
+
+def index_paths(paths, new_only=None, on_file=None, should_stop=None):
+    """
+    Indexa os caminhos dados, um a um.
+    on_file(path, estado) é chamado depois de cada ficheiro; should_stop()
+    é consultado antes de cada um (cancelamento).
+    """
+    count = 0
+    for full in paths:
+        if should_stop and should_stop():
+            break
+        status = index_path(full, new_only=new_only)
+        if status is None:
+            continue
+        count += 1
+        if on_file:
+            on_file(full, status)
     return count
 
 
+def walk_and_index(folder, new_only=None, on_file=None, should_stop=None):
+    return index_paths(iter_supported_files(folder), new_only, on_file, should_stop)
+
+
+def index_listed_files(list_path):
+    """Indexa apenas os ficheiros listados (um caminho por linha)."""
+    with open(list_path, "r", encoding="utf-8") as fh:
+        paths = [line.strip() for line in fh if line.strip()]
+    return index_paths(paths)
+
+
 if __name__ == "__main__":
     print("=" * 60)
     print("DocSearch PT - Indexação (TEXTO + metadados enriquecidos)")
     print("=" * 60)
-    print("Pasta:", INCOMING_DIR)
-    print("Somente novos:", "SIM" if NEW_ONLY else "NÃO")
+    if WORKER_URL:
+        import ingest_remote
+
+        print("Modo: worker remoto de", WORKER_URL)
+        ingest_remote.run_worker(WORKER_URL, once=WORKER_ONCE)
+        sys.exit(0)
+
+    if FREEZE_YEAR:
+        index_partitions.freeze_partition(get_es(), INDEX, int(FREEZE_YEAR))
+        sys.exit(0)
+
+    if COMPLETE_OCR:
+        print("Modo: OCR completo dos documentos pendentes")
+    elif RETRY_FAILED:
+        print("Modo: repetir ficheiros que falharam")
+    elif FILES_FROM:
+        print("Lista de ficheiros:", FILES_FROM)
+    else:
+        print("Pasta:", INCOMING_DIR)
+        print("Somente novos:", "SIM" if NEW_ONLY else "NÃO")
     print("Elasticsearch:", ES_URL)
-    print("Índice:", INDEX)
+    print("Índice:", INDEX, "(partições por ano)" if index_partitions.PARTITION_BY_YEAR else "")
     print("=" * 60)
 
-    ensure_index(es, INDEX)
+    ensure_index(get_es(), INDEX)
+    t_start = time.perf_counter()
+    bulk = False
 
-    if not os.path.exists(INCOMING_DIR):
-        print(f"[ERROR] Pasta {INCOMING_DIR} não encontrada.")
-        sys.exit(1)
+    if COMPLETE_OCR:
+        total = complete_pending_ocr()
+        print("=" * 60)
+        print(f"OCR completo concluído! Total: {total} documento(s)")
+        print("=" * 60)
+        sys.exit(0)
 
-    total = walk_and_index(INCOMING_DIR)
+    if RETRY_FAILED:
+        import ingest_sandbox
+
+        total = index_paths(ingest_sandbox.pop_retry_queue())
+    elif FILES_FROM:
+        total = index_listed_files(FILES_FROM)
+    else:
+        if not os.path.exists(INCOMING_DIR):
+            print(f"[ERROR] Pasta {INCOMING_DIR} não encontrada.")
+            sys.exit(1)
+
+        # Reindexação completa: carga em massa (INGEST_BULK_LOAD=1)
+        bulk = BULK_LOAD and not NEW_ONLY and begin_bulk_load(get_es())
+        try:
+            total = walk_and_index(INCOMING_DIR)
+        finally:
+            if bulk:
+                end_bulk_load(get_es())
 
     print("=" * 60)
-    print(f"Indexação concluída! Total: {total} documento(s)")
+    print(f"Indexação concluída! Total: {throughput_summary(total, time.perf_counter() - t_start, bulk)}")
     print("=" * 60)
+
+    # Modo rápido: as entidades já estão pesquisáveis; o texto completo vem depois
+    if OCR_MODE == "fast" and OCR_FAST_POLICY == "defer":
+        get_es().indices.refresh(index=INDEX)
+        complete_pending_ocr()
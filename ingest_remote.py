@@ -0,0 +1,160 @@
+"""
+Worker remoto de extração: `python ingest.py --worker http://servidor:8000`.
+
+Pede ficheiros à webapp (coordenador, ver ingest_worker.lease), extrai o
+texto e as entidades localmente (no processo isolado do ingest_sandbox,
+como o ingest normal) e envia o documento de volta; é o coordenador que
+indexa no Elasticsearch. Vários workers podem correr na mesma máquina ou
+em máquinas diferentes.
+
+Configuração:
+- INGEST_WORKER_TOKEN: o mesmo token configurado na webapp (obrigatório)
+- INGEST_WORKER_ID: nome do worker nos logs (por defeito, máquina-pid)
+- INGEST_WORKER_POLL: segundos de espera quando não há trabalho (5)
+- INGEST_WORKER_SHARED=1: ler o ficheiro diretamente do caminho do
+  coordenador (pasta partilhada montada no mesmo caminho) em vez de o
+  descarregar
+"""
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+WORKER_TOKEN = os.environ.get("INGEST_WORKER_TOKEN", "")
+WORKER_ID = os.environ.get("INGEST_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+POLL_S = float(os.environ.get("INGEST_WORKER_POLL", "5"))
+SHARED_PATHS = os.environ.get("INGEST_WORKER_SHARED", "0") == "1"
+# Espera máxima entre tentativas quando o coordenador falha (segundos)
+MAX_BACKOFF_S = 300
+
+
+def _download(session, url: str, lease: dict, folder: str) -> str:
+    path = os.path.join(folder, os.path.basename(lease["filename"]))
+    with session.get(f"{url}/api/ingest/lease/{lease['lease_id']}/file", stream=True, timeout=(10, 300)) as resp:
+        resp.raise_for_status()
+        with open(path, "wb") as fh:
+            for block in resp.iter_content(chunk_size=1024 * 1024):
+                fh.write(block)
+    return path
+
+
+def extract(path: str):
+    """
+    Devolve (resultado, spool): o resultado para o coordenador ({"doc"} ou
+    {"error"}) e o ficheiro com as continuações (ou None). Quem chama apaga
+    o spool.
+    """
+    import ingest
+    import ingest_sandbox
+
+    try:
+        if ingest_sandbox.INGEST_ISOLATION:
+            doc = ingest_sandbox.get_sandbox().build(path)
+        else:
+            doc = ingest.build_document(path)
+    except Exception as e:
+        return {"error": str(e)}, None
+    spool = doc.pop("_parts_spool", None)
+    return {"doc": doc}, spool
+
+
+def _send_parts(session, url: str, lease: dict, spool: str) -> bool:
+    """
+    Envia as continuações um bloco por pedido, para nenhum dos lados ter o
+    texto todo em memória. False se a lease expirou.
+    """
+    import ingest
+
+    for chunk in ingest.iter_continuations(spool):
+        reply = session.post(
+            f"{url}/api/ingest/lease/{lease['lease_id']}/parts", json={"parts": [chunk]}, timeout=(10, 300)
+        )
+        if reply.status_code == 410:
+            return False
+        reply.raise_for_status()
+    return True
+
+
+def run_worker(url: str, once: bool = False):
+    """
+    Ciclo do worker: lease -> extração -> resultado. Com `once`, termina
+    quando o coordenador não tiver mais trabalho. Se o coordenador falhar,
+    espera cada vez mais (até MAX_BACKOFF_S) antes de voltar a pedir.
+    """
+    import requests
+
+    url = url.rstrip("/")
+    session = requests.Session()
+    session.headers["X-Ingest-Token"] = WORKER_TOKEN
+    print(f"[REMOTE] Worker {WORKER_ID} ligado a {url}")
+
+    backoff = POLL_S
+    while True:
+        try:
+            resp = session.post(f"{url}/api/ingest/lease", json={"worker": WORKER_ID}, timeout=(10, 60))
+            error = None if resp.status_code in (200, 204, 404) else f"HTTP {resp.status_code}"
+        except requests.RequestException as e:
+            error = str(e)
+        if error:
+            print(f"[WARN] Coordenador indisponível: {error}; nova tentativa em {backoff:.0f}s")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF_S)
+            continue
+        backoff = POLL_S
+        if resp.status_code == 404:
+            print("[ERROR] Leases desligadas ou token inválido (INGEST_WORKER_TOKEN).")
+            return
+        if resp.status_code == 204:
+            if once:
+                return
+            time.sleep(POLL_S)
+            continue
+        lease = resp.json()
+
+        tmpdir = None
+        spool = None
+        try:
+            if SHARED_PATHS and os.path.isfile(lease["path"]):
+                path = lease["path"]
+            else:
+                tmpdir = tempfile.mkdtemp(prefix="docsearch_lease_")
+                try:
+                    path = _download(session, url, lease, tmpdir)
+                except (requests.RequestException, OSError) as e:
+                    # Sem resultado: a lease expira e o ficheiro volta à fila
+                    print(f"[WARN] Falha ao descarregar {lease['filename']}: {e}")
+                    continue
+
+            t0 = time.perf_counter()
+            result, spool = extract(path)
+            ms = int((time.perf_counter() - t0) * 1000)
+            if tmpdir:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+                tmpdir = None
+
+            try:
+                if spool and not _send_parts(session, url, lease, spool):
+                    print(f"[WARN] Lease expirada, resultado descartado: {lease['filename']}")
+                    continue
+                reply = session.post(
+                    f"{url}/api/ingest/lease/{lease['lease_id']}/result", json=result, timeout=(10, 300)
+                )
+            except requests.RequestException as e:
+                print(f"[WARN] Falha ao enviar resultado de {lease['filename']}: {e}")
+                continue
+        finally:
+            if tmpdir:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+            if spool:
+                try:
+                    os.remove(spool)
+                except OSError:
+                    pass
+
+        if reply.status_code == 410:
+            print(f"[WARN] Lease expirada, resultado descartado: {lease['filename']}")
+        elif reply.ok:
+            print(f"[REMOTE] {reply.json().get('status', '?').upper()}: {lease['filename']} ({ms} ms)")
+        else:
+            print(f"[WARN] Coordenador recusou o resultado de {lease['filename']}: HTTP {reply.status_code}")
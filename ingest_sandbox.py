@@ -0,0 +1,191 @@
+"""
+Extração isolada: cada ficheiro é processado num processo filho com
+limite de tempo (INGEST_FILE_TIMEOUT) e de memória (INGEST_MEMORY_MB,
+RLIMIT_AS; só em Linux/macOS).
+
+O filho é reutilizado entre ficheiros (imports quentes). Se um PDF
+patológico o prender ou esgotar a memória, o filho é morto e volta a ser
+lançado no ficheiro seguinte. O ficheiro que falhou fica na fila de
+repetição (`python ingest.py --retry-failed`).
+
+Protocolo: uma linha JSON por pedido no stdin do filho e uma por resposta
+no stdout dele; os prints do ingest no filho vão para o stderr.
+"""
+import io
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+INGEST_ISOLATION = os.environ.get("INGEST_ISOLATION", "1") == "1"
+FILE_TIMEOUT_S = float(os.environ.get("INGEST_FILE_TIMEOUT", "300"))
+MEMORY_LIMIT_MB = int(os.environ.get("INGEST_MEMORY_MB", "2048"))
+RETRY_QUEUE = os.environ.get(
+    "INGEST_RETRY_FILE", os.path.join(BASE_DIR, ".cache", "ingest_retry.txt")
+)
+
+
+class ExtractionFailed(Exception):
+    """A extração de um ficheiro falhou no processo isolado."""
+
+    def __init__(self, kind: str, message: str):
+        super().__init__(f"{kind}: {message}")
+        self.kind = kind  # "timeout" | "memory" | "crash" | "error"
+
+
+class Sandbox:
+    def __init__(self, timeout: float = FILE_TIMEOUT_S, memory_mb: int = MEMORY_LIMIT_MB):
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self._proc = None
+        self._replies = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        env = dict(os.environ, INGEST_MEMORY_MB=str(self.memory_mb))
+        self._proc = subprocess.Popen(
+            [sys.executable, "-u", os.path.abspath(__file__)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=BASE_DIR,
+            env=env,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+        )
+        replies = queue.Queue()
+        self._replies = replies
+
+        def read_replies(stream):
+            for line in stream:
+                replies.put(line)
+            replies.put(None)  # EOF: o filho terminou
+
+        threading.Thread(target=read_replies, args=(self._proc.stdout,), daemon=True).start()
+
+    def _stop(self):
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.kill()
+            proc.wait(timeout=10)
+        except Exception:
+            pass
+
+    def build(self, path: str) -> dict:
+        """Documento do ficheiro (ingest.build_document) construído no processo filho."""
+        with self._lock:
+            if self._proc is None or self._proc.poll() is not None:
+                self._start()
+            try:
+                self._proc.stdin.write(json.dumps({"path": path}) + "\n")
+                self._proc.stdin.flush()
+            except OSError as e:
+                self._stop()
+                raise ExtractionFailed("crash", f"processo de extração indisponível ({e})")
+
+            try:
+                line = self._replies.get(timeout=self.timeout)
+            except queue.Empty:
+                self._stop()
+                raise ExtractionFailed("timeout", f"extração demorou mais de {self.timeout:.0f}s")
+            if line is None:
+                code = self._proc.wait()
+                self._stop()
+                raise ExtractionFailed("crash", f"processo de extração terminou (código {code})")
+
+            reply = json.loads(line)
+            if reply.get("restart"):
+                self._stop()
+            if not reply.get("ok"):
+                raise ExtractionFailed(reply.get("kind", "error"), reply.get("error", ""))
+            return reply["doc"]
+
+    def close(self):
+        with self._lock:
+            self._stop()
+
+
+_sandbox = None
+
+
+def get_sandbox() -> Sandbox:
+    global _sandbox
+    if _sandbox is None:
+        _sandbox = Sandbox()
+    return _sandbox
+
+
+# ---------------- Fila de repetição ----------------
+_queue_lock = threading.Lock()
+
+
+def add_to_retry_queue(path: str, reason: str):
+    with _queue_lock:
+        os.makedirs(os.path.dirname(RETRY_QUEUE), exist_ok=True)
+        with open(RETRY_QUEUE, "a", encoding="utf-8") as fh:
+            fh.write(f"{path}\t{reason.replace(chr(10), ' ')[:300]}\n")
+
+
+def pop_retry_queue() -> list:
+    """Caminhos na fila de repetição (sem repetidos); a fila fica vazia."""
+    with _queue_lock:
+        try:
+            with open(RETRY_QUEUE, "r", encoding="utf-8") as fh:
+                lines = fh.read().splitlines()
+            os.remove(RETRY_QUEUE)
+        except FileNotFoundError:
+            return []
+    paths = [line.split("\t", 1)[0] for line in lines if line.strip()]
+    return list(dict.fromkeys(paths))
+
+
+# ---------------- Processo filho ----------------
+def _limit_memory(memory_mb: int):
+    try:
+        import resource
+    except ImportError:  # Windows: só o timeout se aplica
+        return
+    limit = memory_mb * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _child_main():
+    # Respostas no stdout original; os prints passam a ir para o stderr
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    if MEMORY_LIMIT_MB > 0:
+        _limit_memory(MEMORY_LIMIT_MB)
+    sys.argv = [sys.argv[0]]  # o ingest lê sys.argv no import
+    import ingest
+
+    requests = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8")
+    for line in requests:
+        path = json.loads(line)["path"]
+        t0 = time.perf_counter()
+        try:
+            reply = {"ok": True, "doc": ingest.build_document(path)}
+        except MemoryError:
+            reply = {"ok": False, "kind": "memory", "restart": True,
+                     "error": f"limite de memória ({MEMORY_LIMIT_MB} MB) excedido"}
+        except Exception as e:
+            reply = {"ok": False, "kind": "error", "error": f"{type(e).__name__}: {e}"}
+        reply["ms"] = int((time.perf_counter() - t0) * 1000)
+        replies.write(json.dumps(reply, ensure_ascii=False) + "\n")
+        replies.flush()
+        if reply.get("restart"):
+            break  # processo novo para o ficheiro seguinte
+
+
+if __name__ == "__main__":
+    _child_main()
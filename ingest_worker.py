@@ -0,0 +1,456 @@
+"""
+Worker de indexação residente, usado pela webapp em vez de lançar um
+`python ingest.py` por reindexação ou upload.
+
+Uma thread dedicada processa os trabalhos (pastas ou listas de ficheiros)
+ficheiro a ficheiro. Antes de cada ficheiro escolhe o trabalho ativo de
+maior prioridade (o mais antigo, em caso de empate), por isso um upload
+feito a meio de uma reindexação grande passa à frente logo a seguir ao
+ficheiro em curso; a reindexação continua depois onde estava.
+
+Prioridades: PRIORITY_HIGH (uploads, ficheiros soltos), PRIORITY_MEDIUM
+(alterações detetadas numa pasta) e PRIORITY_LOW (reindexação completa e
+o OCR completo diferido).
+
+Workers remotos (`python ingest.py --worker <url>`, ver ingest_remote.py)
+tiram ficheiros da mesma fila através de leases: lease(), depois
+complete_lease() com o documento extraído. Uma lease que não é concluída
+em INGEST_LEASE_TTL segundos expira e o ficheiro volta à fila. Com
+INGEST_LOCAL_WORKER=0 a thread local deixa a extração aos workers remotos
+(só faz o OCR completo diferido).
+
+O ingest.py e as suas dependências (pdfplumber, pypdfium2, OCR, cliente
+Elasticsearch) são importados uma só vez, no arranque, e ficam quentes
+entre trabalhos. O cancelamento é por trabalho e tem efeito entre ficheiros.
+"""
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+
+
+PRIORITY_HIGH = 0
+PRIORITY_MEDIUM = 1
+PRIORITY_LOW = 2
+
+LEASE_TTL_S = float(os.environ.get("INGEST_LEASE_TTL", "900"))
+LOCAL_WORKER = os.environ.get("INGEST_LOCAL_WORKER", "1") == "1"
+
+_seq = itertools.count()
+
+
+class IngestJob:
+    def __init__(self, job_id: str, folder: str | None = None, files: list | None = None,
+                 only_new: bool = False, on_file=None, on_done=None,
+                 priority: int = PRIORITY_LOW):
+        self.id = job_id
+        self.folder = folder
+        self.files = files
+        self.only_new = only_new
+        self.priority = priority
+        self.seq = next(_seq)
+        self.kind = "index"       # "index" | "complete_ocr"
+        self.on_file = on_file    # on_file(job, caminho, estado)
+        self.on_done = on_done    # on_done(job)
+        self.status = "queued"    # queued -> running -> completed | cancelled | error
+        self.done = 0
+        self.error = None
+        self.log = deque(maxlen=30)
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._items = None        # iterador dos itens (criado por _begin)
+        self._fetch = threading.Lock()  # um só next() de cada vez em _items
+        self._exhausted = False   # _items já não tem mais itens
+        self._retry = deque()     # ficheiros de leases expiradas
+        self._in_flight = 0       # ficheiros em processamento (local ou remoto)
+        self._bulk = False        # carga em massa ativa (ingest.begin_bulk_load)
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+
+# Trabalhos terminados que ficam consultáveis em get_job()
+MAX_FINISHED_JOBS = 100
+
+_active = []   # trabalhos ainda com ficheiros por processar
+_jobs = {}
+_leases = {}   # lease_id -> {"job", "path", "worker", "expires"}
+_lock = threading.Lock()
+_wakeup = threading.Condition(_lock)
+_ocr_job = None
+_thread = None
+_ingest = None
+
+
+def _load_ingest():
+    """Importa o ingest.py (uma vez) e garante que o índice existe."""
+    global _ingest
+    if _ingest is None:
+        t0 = time.perf_counter()
+        import ingest
+
+        ingest.ensure_index(ingest.get_es(), ingest.INDEX)
+        _ingest = ingest
+        print(f"[WORKER] ingest carregado em {time.perf_counter() - t0:.1f}s")
+    return _ingest
+
+
+def _begin(job: IngestJob, ingest):
+    """Prepara os itens do trabalho (I/O: chamar sem o _lock)."""
+    if job.kind == "complete_ocr":
+        ingest.get_es().indices.refresh(index=ingest.INDEX)
+        items = iter(ingest.list_pending_ocr())
+    elif job.files is not None:
+        items = iter(job.files)
+    else:
+        items = ingest.iter_supported_files(job.folder)
+        # Reindexação completa de uma pasta: carga em massa (INGEST_BULK_LOAD=1)
+        if ingest.BULK_LOAD and not job.only_new:
+            job._bulk = ingest.begin_bulk_load(ingest.get_es())
+    with _lock:
+        job._items = items
+
+
+def _expire_leases() -> list:
+    """
+    Devolve à fila os ficheiros de leases expiradas (chamar com o _lock).
+    Devolve os spools de continuações a apagar (fora do _lock).
+    """
+    now = time.time()
+    spools = []
+    for lease_id, lease in list(_leases.items()):
+        if lease["expires"] < now:
+            del _leases[lease_id]
+            job = lease["job"]
+            job._in_flight -= 1
+            if not job.cancelled:
+                job._retry.append(lease["path"])
+            if lease.get("spool"):
+                spools.append(lease["spool"])
+            print(f"[WORKER] Lease expirada ({lease['worker']}): {lease['path']}")
+    return spools
+
+
+def _remove_spools(spools):
+    for spool in spools:
+        try:
+            os.remove(spool)
+        except OSError:
+            pass
+
+
+def _take(remote: bool = False):
+    """
+    Próximo (trabalho, item) por prioridade, ou (None, None) se não houver
+    nada para já. Trabalhos sem itens nem ficheiros em curso terminam aqui.
+    Os workers remotos só recebem ficheiros de trabalhos de indexação.
+
+    O _lock só protege a escolha do trabalho: o arranque (_begin) e a
+    leitura do próximo item (os.walk) correm fora dele, com o trabalho
+    marcado como em curso, para não bloquear os outros workers.
+    """
+    ingest = _load_ingest()
+    while True:
+        finished = starting = fetching = None
+        with _lock:
+            stale_spools = _expire_leases()
+            for job in sorted(_active, key=lambda j: (j.priority, j.seq)):
+                if remote:
+                    can_take = job.kind == "index"
+                else:
+                    can_take = LOCAL_WORKER or job.kind != "index"
+                can_take = can_take and not job.cancelled
+                if job.status == "queued" and not job.cancelled:
+                    if not can_take:
+                        # Arrancar (refresh, listagens) cabe a quem pode tirar itens
+                        continue
+                    job.status = "running"
+                    job.started_at = time.time()
+                    starting = job
+                    break
+                if job._items is None and not job.cancelled:
+                    continue  # outro worker está a arrancar o trabalho
+                if can_take and job._retry:
+                    job._in_flight += 1
+                    return job, job._retry.popleft()
+                if can_take and not job._exhausted:
+                    # Reservado: o trabalho não termina enquanto se lê o item
+                    job._in_flight += 1
+                    fetching = job
+                    break
+                if job._in_flight == 0 and (job.cancelled or can_take):
+                    finished = (job, "cancelled" if job.cancelled else "completed")
+                    break
+            else:
+                _remove_spools(stale_spools)
+                return None, None
+        _remove_spools(stale_spools)
+
+        if starting is not None:
+            try:
+                _begin(starting, ingest)
+            except Exception as e:
+                finished = (starting, _failed(starting, e))
+        elif fetching is not None:
+            try:
+                with fetching._fetch:
+                    item = next(fetching._items, None)
+            except Exception as e:
+                item = None
+                finished = (fetching, _failed(fetching, e))
+            if item is not None:
+                return fetching, item
+            with _lock:
+                fetching._in_flight -= 1
+                fetching._exhausted = True
+        if finished is not None:
+            _finish(*finished, ingest)
+
+
+def _failed(job: IngestJob, error) -> str:
+    job.error = str(error)
+    print(f"[WORKER] Trabalho {job.id} falhou: {error}")
+    return "error"
+
+
+def _complete(job: IngestJob, path, status: str | None):
+    """Regista o fim de um ficheiro do trabalho (status None = ignorado)."""
+    with _wakeup:
+        job._in_flight -= 1
+        if status is not None:
+            job.done += 1
+            job.log.append(f"{status.upper()}: {path}")
+        _wakeup.notify_all()
+    if status is not None and job.on_file:
+        job.on_file(job, path, status)
+
+
+def _refresh_if_bulk(job: IngestJob, ingest):
+    """Durante uma carga em massa o refresh está desligado: os ficheiros de
+    trabalhos prioritários (uploads) ficam pesquisáveis logo."""
+    if job.priority == PRIORITY_HIGH and ingest.bulk_load_active():
+        try:
+            ingest.get_es().indices.refresh(index=ingest.INDEX)
+        except Exception as e:
+            print(f"[WARN] Refresh falhou: {e}")
+
+
+def _process(job: IngestJob, item, ingest):
+    if job.kind == "complete_ocr":
+        _complete(job, item[1].get("path"), ingest.complete_ocr_doc(*item))
+    else:
+        status = ingest.index_path(item, new_only=job.only_new)
+        if status is not None:
+            _refresh_if_bulk(job, ingest)
+        _complete(job, item, status)
+
+
+def _finish(job: IngestJob, status: str, ingest):
+    with _lock:
+        if job not in _active:
+            return
+        _active.remove(job)
+    if job._bulk:
+        # Repor as definições do índice também em cancelamento ou erro
+        try:
+            ingest.end_bulk_load(ingest.get_es())
+        except Exception as e:
+            print(f"[WARN] Falha ao repor as definições do índice: {e}")
+    job.status = status
+    job.finished_at = time.time()
+    if job.started_at and job.kind == "index":
+        summary = ingest.throughput_summary(job.done, job.finished_at - job.started_at, job._bulk)
+        job.log.append(f"TOTAL: {summary}")
+        print(f"[WORKER] Trabalho {job.id} {status}: {summary}")
+    if job.on_done:
+        try:
+            job.on_done(job)
+        except Exception as e:
+            print(f"[WORKER] on_done falhou para {job.id}: {e}")
+
+    # OCR rápido com política "defer": completar o texto com prioridade baixa
+    if (job.kind == "index" and status == "completed"
+            and ingest.OCR_MODE == "fast" and ingest.OCR_FAST_POLICY == "defer"):
+        _submit_complete_ocr()
+
+
+def _submit_complete_ocr():
+    """Um só trabalho de OCR completo pendente de cada vez."""
+    global _ocr_job
+    with _wakeup:
+        if _ocr_job is not None and _ocr_job.status == "queued":
+            return
+        _ocr_job = IngestJob(f"complete-ocr-{int(time.time())}", priority=PRIORITY_LOW)
+        _ocr_job.kind = "complete_ocr"
+        _active.append(_ocr_job)
+        _wakeup.notify_all()
+
+
+def _loop():
+    try:
+        _load_ingest()
+    except Exception as e:
+        # Sem ES no arranque: volta a tentar no primeiro trabalho
+        print(f"[WORKER] Pré-carregamento falhou: {e}")
+
+    while True:
+        try:
+            job, item = _take()
+        except Exception as e:
+            print(f"[WORKER] Falha ao obter trabalho: {e}")
+            job = item = None
+        if job is None:
+            with _wakeup:
+                # Acorda com trabalho novo ou para verificar leases expiradas
+                _wakeup.wait(timeout=min(LEASE_TTL_S, 30))
+            continue
+        try:
+            _process(job, item, _load_ingest())
+        except Exception as e:
+            print(f"[WORKER] Falha em {item} ({job.id}): {e}")
+            _complete(job, item, "error")
+
+
+def start():
+    """Arranca a thread do worker (idempotente) e pré-carrega o ingest."""
+    global _thread
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_loop, name="ingest-worker", daemon=True)
+            _thread.start()
+
+
+def submit(job_id: str, folder: str | None = None, files: list | None = None,
+           only_new: bool = False, on_file=None, on_done=None,
+           priority: int | None = None) -> IngestJob:
+    """
+    Põe um trabalho na fila: uma pasta (`folder`) ou uma lista de ficheiros
+    (`files`). Sem `priority`, listas de ficheiros são PRIORITY_HIGH e
+    pastas PRIORITY_LOW.
+    """
+    start()
+    if priority is None:
+        priority = PRIORITY_HIGH if files is not None else PRIORITY_LOW
+    job = IngestJob(job_id, folder, files, only_new, on_file, on_done, priority)
+    with _wakeup:
+        # Esquecer trabalhos antigos já terminados
+        finished = [j.id for j in _jobs.values() if j.finished_at]
+        for old_id in finished[:-MAX_FINISHED_JOBS]:
+            _jobs.pop(old_id, None)
+        _jobs[job_id] = job
+        _active.append(job)
+        _wakeup.notify_all()
+    return job
+
+
+def get_job(job_id: str) -> IngestJob | None:
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def cancel(job_id: str) -> bool:
+    """Pede o cancelamento; os ficheiros em curso terminam primeiro."""
+    job = get_job(job_id)
+    if job is None or job.status in ("completed", "cancelled", "error"):
+        return False
+    job.cancel()
+    with _wakeup:
+        _wakeup.notify_all()
+    return True
+
+
+# ---------------- Leases para workers remotos ----------------
+def lease(worker: str) -> dict | None:
+    """
+    Entrega o próximo ficheiro a um worker remoto, ou None se não houver.
+    Devolve {"lease_id", "path", "filename", "size", "ttl"}.
+    """
+    ingest = _load_ingest()
+    while True:
+        job, path = _take(remote=True)
+        if job is None:
+            return None
+        # As mesmas verificações que o index_path/index_file fazem localmente
+        if not os.path.isfile(path) or not any(path.lower().endswith(ext) for ext in ingest.SUPPORTED_EXTS):
+            _complete(job, path, None)
+            continue
+        if job.only_new and ingest.is_indexed(path):
+            _complete(job, path, "skipped")
+            continue
+
+        lease_id = uuid.uuid4().hex
+        with _lock:
+            _leases[lease_id] = {
+                "job": job,
+                "path": path,
+                "worker": worker,
+                "expires": time.time() + LEASE_TTL_S,
+            }
+        print(f"[WORKER] Lease {lease_id[:8]} -> {worker}: {os.path.basename(path)}")
+        return {
+            "lease_id": lease_id,
+            "path": path,
+            "filename": os.path.basename(path),
+            "size": os.path.getsize(path),
+            "ttl": LEASE_TTL_S,
+        }
+
+
+def lease_path(lease_id: str) -> str | None:
+    """Caminho do ficheiro de uma lease ativa (para o worker o descarregar)."""
+    with _lock:
+        lease = _leases.get(lease_id)
+        return lease["path"] if lease else None
+
+
+def add_lease_parts(lease_id: str, parts: list) -> bool:
+    """
+    Acrescenta continuações (blocos de páginas) de uma lease a um spool em
+    disco, como o TextCollector faz localmente; são indexadas com o
+    resultado. False se a lease já expirou ou não existe.
+    """
+    with _lock:
+        lease = _leases.get(lease_id)
+        if lease is None:
+            return False
+        if lease.get("spool") is None:
+            fd, lease["spool"] = tempfile.mkstemp(prefix="docsearch_parts_", suffix=".jsonl")
+            os.close(fd)
+        spool = lease["spool"]
+    with open(spool, "a", encoding="utf-8") as fh:
+        for chunk in parts:
+            fh.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+    return True
+
+
+def complete_lease(lease_id: str, result: dict) -> str | None:
+    """
+    Indexa o resultado de uma lease (ver ingest.index_remote_result), com as
+    continuações recebidas antes por add_lease_parts, e devolve o estado;
+    None se a lease já expirou ou não existe.
+    """
+    with _lock:
+        lease = _leases.pop(lease_id, None)
+    if lease is None:
+        return None
+    job, path, spool = lease["job"], lease["path"], lease.get("spool")
+    try:
+        status = _load_ingest().index_remote_result(path, result, spool)
+    except Exception as e:
+        print(f"[WORKER] Falha ao indexar resultado de {lease['worker']} para {path}: {e}")
+        status = "error"
+    finally:
+        if spool:
+            _remove_spools([spool])
+    _refresh_if_bulk(job, _load_ingest())
+    _complete(job, path, status)
+    return status
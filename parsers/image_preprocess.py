@@ -0,0 +1,154 @@
+"""
+Pré-processamento de imagens antes do Tesseract (NumPy + Pillow).
+
+Passos, configuráveis por perfil de origem:
+- normalização de DPI (reduz fotos/scans enormes para ~300 DPI)
+- recorte de margens em branco
+- correção de inclinação (deskew) por perfil de projeção
+- binarização adaptativa (limiar pela média local)
+
+Perfis: "pdf" (páginas renderizadas de PDFs digitalizados), "scan"
+(TIFF/PNG de scanner) e "photo" (fotos de telemóvel). OCR_PREPROCESS=off
+desliga tudo; OCR_PREPROCESS=<perfil> força o mesmo perfil para todas as
+origens.
+"""
+import os
+
+import numpy as np
+from PIL import Image
+
+OCR_PREPROCESS = os.environ.get("OCR_PREPROCESS", "auto").strip().lower()
+# DPI alvo para o Tesseract (o perfil "pdf" usa OCR_PDF_DPI)
+TARGET_DPI = int(os.environ.get("OCR_TARGET_DPI", "300"))
+PDF_DPI = int(os.environ.get("OCR_PDF_DPI", "200"))
+# Sem DPI nos metadados, o lado maior fica limitado a isto (A4 a 300 DPI)
+MAX_SIDE_PX = int(os.environ.get("OCR_MAX_SIDE_PX", "3508"))
+
+PROFILES = {
+    "pdf": {"dpi": PDF_DPI, "deskew": True, "threshold": False, "crop": True},
+    "scan": {"dpi": TARGET_DPI, "deskew": True, "threshold": True, "crop": True},
+    "photo": {"dpi": TARGET_DPI, "deskew": True, "threshold": True, "crop": True,
+              "block": 41, "offset": 25},
+    "off": {"dpi": TARGET_DPI, "deskew": False, "threshold": False, "crop": False},
+}
+DEFAULT_BLOCK = 31   # janela (px) da binarização adaptativa
+DEFAULT_OFFSET = 20  # quanto abaixo da média local um pixel conta como tinta
+MAX_SKEW_DEG = 5.0
+SKEW_STEP_DEG = 0.5
+
+
+def profile_for(ext: str) -> str:
+    """Perfil a usar para uma extensão (respeita OCR_PREPROCESS)."""
+    if OCR_PREPROCESS != "auto":
+        return OCR_PREPROCESS if OCR_PREPROCESS in PROFILES else "off"
+    ext = ext.lower()
+    if ext == ".pdf":
+        return "pdf"
+    if ext in (".jpg", ".jpeg"):
+        return "photo"
+    return "scan"
+
+
+def profile_dpi(profile: str) -> int:
+    return PROFILES.get(profile, PROFILES["off"])["dpi"]
+
+
+def pdf_render_scale(profile: str = "pdf") -> float:
+    """Escala do pypdfium2 (1.0 = 72 DPI) para renderizar ao DPI do perfil."""
+    return profile_dpi(profile) / 72.0
+
+
+def normalize_dpi(img: Image.Image, target_dpi: int = TARGET_DPI) -> Image.Image:
+    """Reduz a imagem para o DPI alvo (nunca aumenta)."""
+    dpi = img.info.get("dpi")
+    try:
+        source_dpi = float(dpi[0]) if dpi else 0.0
+    except (TypeError, ValueError, IndexError):
+        source_dpi = 0.0
+
+    if source_dpi > target_dpi * 1.1:
+        factor = target_dpi / source_dpi
+    else:
+        factor = MAX_SIDE_PX * target_dpi / TARGET_DPI / max(img.size)
+    if factor >= 1.0:
+        return img
+    size = (max(1, round(img.width * factor)), max(1, round(img.height * factor)))
+    return img.resize(size, Image.LANCZOS)
+
+
+def crop_margins(arr: np.ndarray, pad: int = 16, ink: int = 160) -> np.ndarray:
+    """Corta as margens sem tinta (pixels mais claros que `ink`)."""
+    mask = arr < ink
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if rows.size == 0 or cols.size == 0:
+        return arr
+    top, bottom = max(rows[0] - pad, 0), min(rows[-1] + pad + 1, arr.shape[0])
+    left, right = max(cols[0] - pad, 0), min(cols[-1] + pad + 1, arr.shape[1])
+    return arr[top:bottom, left:right]
+
+
+def estimate_skew(arr: np.ndarray, ink: int = 160) -> float:
+    """
+    Ângulo (graus) que endireita o texto: o que maximiza a variância da
+    soma das linhas (linhas de texto bem separadas). Calculado numa cópia
+    reduzida para ser barato.
+    """
+    small = Image.fromarray(((arr < ink) * 255).astype(np.uint8))
+    small.thumbnail((800, 800))
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-MAX_SKEW_DEG, MAX_SKEW_DEG + 1e-6, SKEW_STEP_DEG):
+        rotated = np.asarray(small.rotate(float(angle), resample=Image.NEAREST, fillcolor=0))
+        score = float(np.var(rotated.sum(axis=1, dtype=np.int64)))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def adaptive_threshold(arr: np.ndarray, block: int = DEFAULT_BLOCK,
+                       offset: int = DEFAULT_OFFSET) -> np.ndarray:
+    """Binariza pela média local (janela `block`), com somas cumulativas separáveis."""
+    h, w = arr.shape
+    r = block // 2
+    y0 = np.clip(np.arange(h) - r, 0, h)
+    y1 = np.clip(np.arange(h) + r + 1, 0, h)
+    x0 = np.clip(np.arange(w) - r, 0, w)
+    x1 = np.clip(np.arange(w) + r + 1, 0, w)
+
+    # soma na janela: primeiro na vertical, depois na horizontal (int32 chega)
+    cols = np.pad(arr.astype(np.int32), ((1, 0), (0, 0))).cumsum(0, dtype=np.int32)
+    vsum = cols[y1] - cols[y0]
+    del cols
+    rows = np.pad(vsum, ((0, 0), (1, 0))).cumsum(1, dtype=np.int32)
+    sums = rows[:, x1] - rows[:, x0]
+    del rows, vsum
+    area = (y1 - y0)[:, None] * (x1 - x0)[None, :]
+
+    # pixel < média - offset  <=>  pixel * área < soma - offset * área
+    ink = arr.astype(np.int32) * area < sums - offset * area
+    return np.where(ink, 0, 255).astype(np.uint8)
+
+
+def preprocess(img: Image.Image, profile: str = "scan", dpi: int | None = None) -> Image.Image:
+    """
+    Aplica o perfil à imagem e devolve uma imagem em tons de cinza ("L").
+    `dpi` substitui o DPI alvo do perfil (ex.: degraus do OCR adaptativo).
+    """
+    opts = PROFILES.get(profile, PROFILES["off"])
+    img = normalize_dpi(img, dpi or opts["dpi"])
+    gray = img.convert("L")
+    if profile == "off":
+        return gray
+
+    arr = np.asarray(gray)
+    if opts["deskew"]:
+        angle = estimate_skew(arr)
+        if angle:
+            gray = gray.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+            arr = np.asarray(gray)
+    if opts["crop"]:
+        arr = crop_margins(arr)
+    if opts["threshold"]:
+        arr = adaptive_threshold(arr, opts.get("block", DEFAULT_BLOCK),
+                                 opts.get("offset", DEFAULT_OFFSET))
+    return Image.fromarray(arr)
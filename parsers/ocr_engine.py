@@ -0,0 +1,131 @@
+"""
+Motores de OCR (Tesseract).
+
+- "tesserocr": API C do Tesseract no próprio processo. Os modelos por+eng
+  ficam carregados (uma instância por thread) e as imagens passam em
+  memória, sem ficheiros temporários nem um processo novo por página.
+- "pytesseract": chama o executável `tesseract` (fallback, sempre disponível
+  se o Tesseract estiver instalado).
+
+OCR_ENGINE=auto (por defeito) usa o tesserocr quando está instalado.
+"""
+import os
+import threading
+
+OCR_ENGINE = os.environ.get("OCR_ENGINE", "auto").strip().lower()
+OCR_LANG = os.environ.get("OCR_LANG", "por+eng")
+# Pasta tessdata (opcional; o tesserocr usa a da instalação por defeito)
+TESSDATA_PREFIX = os.environ.get("TESSDATA_PREFIX")
+# Executável do Tesseract para o pytesseract (Windows: caminho por defeito do instalador)
+TESSERACT_PATH = os.environ.get("TESSERACT_PATH", r"C:\Program Files\Tesseract-OCR\tesseract.exe")
+
+_pytesseract = None
+
+
+def _load_pytesseract():
+    global _pytesseract
+    if _pytesseract is None:
+        import pytesseract
+
+        if os.path.exists(TESSERACT_PATH):
+            pytesseract.pytesseract.tesseract_cmd = TESSERACT_PATH
+        _pytesseract = pytesseract
+    return _pytesseract
+
+
+class PytesseractEngine:
+    name = "pytesseract"
+
+    def image_to_data(self, img, dpi: int = 300, psm: int = 6) -> tuple[str, float]:
+        """(texto, confiança média das palavras 0-100) via `image_to_data`."""
+        pytesseract = _load_pytesseract()
+
+        data = pytesseract.image_to_data(
+            img,
+            lang=OCR_LANG,
+            config=f"--oem 3 --psm {psm} --dpi {dpi}",
+            output_type=pytesseract.Output.DICT,
+        )
+        lines = {}
+        confs = []
+        for i, word in enumerate(data["text"]):
+            conf = float(data["conf"][i])
+            if conf < 0 or not word.strip():
+                continue
+            key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            lines.setdefault(key, []).append(word)
+            confs.append(conf)
+        text = "\n".join(" ".join(words) for words in lines.values())
+        return text, (sum(confs) / len(confs) if confs else 0.0)
+
+    def image_to_text(self, img, dpi: int = 300, psm: int = 6) -> str:
+        pytesseract = _load_pytesseract()
+
+        return pytesseract.image_to_string(
+            img,
+            lang=OCR_LANG,
+            config=f"--oem 3 --psm {psm} --dpi {dpi}",
+        ).strip()
+
+
+class TesserocrEngine:
+    """Uma PyTessBaseAPI por thread (a API não é thread-safe), reutilizada entre páginas."""
+
+    name = "tesserocr"
+
+    def __init__(self):
+        import tesserocr  # falha já aqui se não estiver instalado
+
+        self._tesserocr = tesserocr
+        self._local = threading.local()
+
+    def _api(self, psm: int):
+        api = getattr(self._local, "api", None)
+        if api is None:
+            kwargs = {"lang": OCR_LANG, "oem": self._tesserocr.OEM.DEFAULT}
+            if TESSDATA_PREFIX:
+                kwargs["path"] = TESSDATA_PREFIX
+            api = self._tesserocr.PyTessBaseAPI(**kwargs)
+            self._local.api = api
+        api.SetPageSegMode(psm)
+        return api
+
+    def image_to_data(self, img, dpi: int = 300, psm: int = 6) -> tuple[str, float]:
+        api = self._api(psm)
+        api.SetImage(img)
+        api.SetSourceResolution(dpi)
+        try:
+            text = (api.GetUTF8Text() or "").strip()
+            confs = [c for c in api.AllWordConfidences() if c >= 0]
+        finally:
+            api.Clear()
+        return text, (sum(confs) / len(confs) if confs else 0.0)
+
+    def image_to_text(self, img, dpi: int = 300, psm: int = 6) -> str:
+        api = self._api(psm)
+        api.SetImage(img)
+        api.SetSourceResolution(dpi)
+        try:
+            return (api.GetUTF8Text() or "").strip()
+        finally:
+            api.Clear()
+
+
+_engine = None
+_lock = threading.Lock()
+
+
+def get_engine():
+    """Motor configurado em OCR_ENGINE (criado uma vez por processo)."""
+    global _engine
+    with _lock:
+        if _engine is None:
+            if OCR_ENGINE in ("auto", "tesserocr"):
+                try:
+                    _engine = TesserocrEngine()
+                except Exception as e:
+                    if OCR_ENGINE == "tesserocr":
+                        print(f"[WARN] tesserocr indisponível ({e}); a usar pytesseract")
+            if _engine is None:
+                _engine = PytesseractEngine()
+        return _engine
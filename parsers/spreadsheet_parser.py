@@ -0,0 +1,132 @@
+import os
+import re
+
+# Limite de células lidas por ficheiro (memória limitada em livros enormes)
+MAX_CELLS = int(os.environ.get("SPREADSHEET_MAX_CELLS", "200000"))
+
+NIF_RE = re.compile(r"^\s*(?:PT)?\s?([1235689]\d{8})\s*$", re.IGNORECASE)
+TOTAL_LABEL_RE = re.compile(r"\b(total|valor\s+a\s+pagar|montante)\b", re.IGNORECASE)
+# Máximo de NIFs/totais guardados por folha
+MAX_VALUES_PER_SHEET = 20
+
+AMOUNT_RE = re.compile(r"^\s*€?\s*(-?\d{1,3}(?:[.\s]\d{3})*(?:,\d{1,2})|-?\d+(?:[.,]\d{1,2})?)\s*€?\s*$")
+
+
+def _cell_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _to_amount(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    m = AMOUNT_RE.match(str(value or ""))
+    if not m:
+        return None
+    s = m.group(1).replace(" ", "")
+    if "," in s:
+        s = s.replace(".", "").replace(",", ".")
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def _scan_row(values: list, sheet: dict):
+    """Recolhe NIFs e totais ('Total' seguido de um valor na mesma linha)."""
+    label_seen = False
+    for value in values:
+        text = _cell_text(value)
+        if not text:
+            continue
+        m = NIF_RE.match(text)
+        if m:
+            if m.group(1) not in sheet["nifs"] and len(sheet["nifs"]) < MAX_VALUES_PER_SHEET:
+                sheet["nifs"].append(m.group(1))
+            continue
+        if label_seen:
+            amount = _to_amount(value)
+            if amount is not None:
+                if len(sheet["totals"]) < MAX_VALUES_PER_SHEET:
+                    sheet["totals"].append(amount)
+                label_seen = False
+                continue
+        if isinstance(value, str) and TOTAL_LABEL_RE.search(value):
+            label_seen = True
+
+
+def _iter_xlsx(path):
+    """(nome_da_folha, linhas) com openpyxl em modo streaming (read_only)."""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            yield ws.title, ws.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def _iter_xls(path):
+    """(nome_da_folha, linhas) com xlrd, carregando uma folha de cada vez."""
+    import xlrd
+
+    book = xlrd.open_workbook(path, on_demand=True)
+    try:
+        for idx in range(book.nsheets):
+            sh = book.sheet_by_index(idx)
+            yield sh.name, (sh.row_values(r) for r in range(sh.nrows))
+            book.unload_sheet(idx)
+    finally:
+        book.release_resources()
+
+
+def parse_spreadsheet(path: str, max_cells: int = MAX_CELLS):
+    """
+    Extrai texto e dados estruturados de .xlsx/.xls sem passar pelo Tika.
+    Lê linha a linha e pára ao fim de `max_cells` células.
+    Devolve {"text", "engine", "sheets": [{name, rows, nifs, totals}], "truncated"}.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".xls":
+        engine, sheets_iter = "xlrd", _iter_xls(path)
+    else:
+        engine, sheets_iter = "openpyxl", _iter_xlsx(path)
+
+    parts = []
+    sheets = []
+    cells = 0
+    truncated = False
+
+    try:
+        for name, rows in sheets_iter:
+            sheet = {"name": name, "rows": 0, "nifs": [], "totals": []}
+            sheets.append(sheet)
+            parts.append(f"## {name}")
+            for row in rows:
+                values = [v for v in row if v is not None and v != ""]
+                if not values:
+                    continue
+                if cells + len(values) > max_cells:
+                    truncated = True
+                    break
+                cells += len(values)
+                sheet["rows"] += 1
+                parts.append("\t".join(_cell_text(v) for v in values))
+                _scan_row(values, sheet)
+            if truncated:
+                break
+    finally:
+        sheets_iter.close()  # fecha o livro mesmo quando se pára a meio
+
+    return {
+        "text": "\n".join(parts).strip(),
+        "engine": engine,
+        "sheets": sheets,
+        "truncated": truncated,
+    }
@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from urllib.parse import quote
+
+# Servidor Tika (ver docker-compose.yml)
+TIKA_URL = os.environ.get("TIKA_URL", "http://localhost:9998").rstrip("/")
+# Timeouts (s): ligação e leitura da resposta
+TIKA_CONNECT_TIMEOUT = float(os.environ.get("TIKA_CONNECT_TIMEOUT", "3"))
+TIKA_TIMEOUT = float(os.environ.get("TIKA_TIMEOUT", "120"))
+# Pedidos em simultâneo: a JVM do Tika por defeito tem só 512 MB
+TIKA_CONCURRENCY = int(os.environ.get("TIKA_CONCURRENCY", "2"))
+# Circuit breaker: após N falhas seguidas, não chamar o Tika durante X segundos
+TIKA_BREAKER_FAILURES = int(os.environ.get("TIKA_BREAKER_FAILURES", "3"))
+TIKA_BREAKER_COOLDOWN = float(os.environ.get("TIKA_BREAKER_COOLDOWN", "60"))
+
+
+class TikaUnavailable(Exception):
+    """O circuit breaker está aberto: o Tika falhou repetidamente há pouco tempo."""
+
+
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(TIKA_CONCURRENCY)
+_session = None
+_failures = 0
+_open_until = 0.0
+
+
+def _get_session():
+    """Sessão HTTP partilhada (keep-alive), com pool do tamanho da concorrência."""
+    global _session
+    with _lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=TIKA_CONCURRENCY)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def breaker_open() -> bool:
+    """True enquanto o Tika deve ser saltado (falhas recentes)."""
+    return time.monotonic() < _open_until
+
+
+def _record_success():
+    global _failures, _open_until
+    with _lock:
+        _failures = 0
+        _open_until = 0.0
+
+
+def _record_failure():
+    global _failures, _open_until
+    with _lock:
+        _failures += 1
+        if _failures >= TIKA_BREAKER_FAILURES:
+            _open_until = time.monotonic() + TIKA_BREAKER_COOLDOWN
+            print(
+                f"[WARN] Tika falhou {_failures} vez(es) seguidas; "
+                f"a saltar o Tika durante {TIKA_BREAKER_COOLDOWN:.0f}s"
+            )
+
+
+def content_disposition(filename: str) -> str:
+    """
+    Cabeçalho Content-Disposition com o nome em RFC 5987 (filename*=UTF-8''),
+    mais um nome ASCII de recurso: aspas, ’ ou € no nome não rebentam o pedido.
+    """
+    fallback = "".join(c if 32 <= ord(c) < 127 and c not in '"\\' else "_" for c in filename)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+def extract_text(path: str, max_chars: int | None = None) -> str:
+    """
+    Envia o ficheiro ao Tika (PUT /tika, em streaming) e devolve o texto.
+    Com `max_chars`, a resposta é lida só até esse tamanho.
+    Lança TikaUnavailable com o breaker aberto, ou a exceção do pedido.
+    Só contam para o breaker falhas de ligação, timeouts e respostas 5xx;
+    depois do cooldown, o pedido seguinte serve de teste (half-open).
+    """
+    import requests
+
+    if breaker_open():
+        raise TikaUnavailable(f"Tika indisponível ({TIKA_URL})")
+
+    session = _get_session()
+    with _slots:
+        # Ficheiro em falta ou ilegível: erro do ficheiro, não do Tika
+        with open(path, "rb") as fh:
+            try:
+                resp = session.put(
+                    f"{TIKA_URL}/tika",
+                    data=fh,
+                    headers={
+                        "Accept": "text/plain",
+                        "Content-Disposition": content_disposition(os.path.basename(path)),
+                    },
+                    timeout=(TIKA_CONNECT_TIMEOUT, TIKA_TIMEOUT),
+                    stream=True,
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                _record_failure()
+                raise
+        with resp:
+            # 422/415: ficheiro que o Tika não consegue ler, o servidor está bom
+            if resp.status_code in (415, 422):
+                _record_success()
+                return ""
+            if resp.status_code >= 500:
+                _record_failure()
+            resp.raise_for_status()
+            try:
+                body = _read_body(resp, max_chars)
+            except (requests.ConnectionError, requests.Timeout):
+                _record_failure()
+                raise
+
+    _record_success()
+    text = body.decode("utf-8", errors="replace")
+    if max_chars is not None:
+        text = text[:max_chars]
+    return text.strip()
+
+
+def _read_body(resp, max_chars: int | None) -> bytes:
+    if max_chars is None:
+        return resp.content
+    # UTF-8: no máximo 4 bytes por carácter
+    max_bytes = max_chars * 4
+    chunks = []
+    size = 0
+    for chunk in resp.iter_content(chunk_size=64 * 1024):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= max_bytes:
+            break
+    return b"".join(chunks)[:max_bytes]
@@ -0,0 +1,188 @@
+"""
+Cache de miniaturas (primeira página ou página com o resultado) para a
+lista de resultados.
+
+As miniaturas são geradas com pypdfium2 (PDF) ou Pillow (imagens), gravadas
+em disco (WebP, ou PNG se o Pillow não suportar WebP) com chave pelo
+caminho, tamanho e mtime do ficheiro (stat no servidor) e removidas por LRU
+quando a cache passa PREVIEW_CACHE_MB.
+Usado pela webapp (/preview) e, opcionalmente, pelo ingest.py
+(PREVIEW_PREGEN=1) para gerar a miniatura da 1ª página durante a indexação.
+"""
+import hashlib
+import os
+import threading
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PREVIEW_DIR = os.environ.get("PREVIEW_CACHE_DIR", os.path.join(BASE_DIR, ".cache", "previews"))
+PREVIEW_CACHE_MB = int(os.environ.get("PREVIEW_CACHE_MB", "500"))
+DEFAULT_WIDTH = 320
+MIN_WIDTH, MAX_WIDTH = 64, 1200
+
+PREVIEW_EXTS = [".pdf", ".png", ".jpg", ".jpeg", ".tiff", ".tif"]
+
+# A limpeza LRU percorre a pasta; só corre a cada N miniaturas novas
+_EVICT_EVERY = 50
+_writes_since_evict = _EVICT_EVERY
+_lock = threading.Lock()
+_format = None
+# Nº de páginas por ficheiro (chave: caminho|tamanho|mtime), para limitar a página pedida
+_PAGE_COUNTS_MAX = 4096
+_page_counts = {}
+
+
+def preview_format() -> tuple[str, str]:
+    """(formato Pillow, extensão) das miniaturas."""
+    global _format
+    if _format is None:
+        from PIL import features
+
+        _format = ("WEBP", "webp") if features.check("webp") else ("PNG", "png")
+    return _format
+
+
+def media_type() -> str:
+    return "image/" + preview_format()[1]
+
+
+def clamp_width(width: int | None) -> int:
+    return max(MIN_WIDTH, min(int(width or DEFAULT_WIDTH), MAX_WIDTH))
+
+
+def page_count(path: str) -> int:
+    """Nº de páginas (PDF) ou de frames (TIFF); 1 nas outras imagens."""
+    if os.path.splitext(path)[1].lower() == ".pdf":
+        import pypdfium2
+
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return getattr(img, "n_frames", 1)
+
+
+def _clamp_page(path: str, page: int, fingerprint: str) -> int:
+    """Página pedida limitada à última, como o render_preview faz."""
+    page = max(1, int(page or 1))
+    if page == 1:
+        return 1
+    with _lock:
+        count = _page_counts.get(fingerprint)
+    if count is None:
+        count = max(1, page_count(path))
+        with _lock:
+            if len(_page_counts) >= _PAGE_COUNTS_MAX:
+                _page_counts.clear()
+            _page_counts[fingerprint] = count
+    return min(page, count)
+
+
+def preview_key(path: str, page: int, width: int) -> str:
+    """
+    Chave da miniatura: caminho + tamanho + mtime, sempre do stat do
+    ficheiro (nunca de um valor vindo do pedido), por isso um ficheiro
+    alterado gera uma miniatura nova. A página entra já limitada ao nº de
+    páginas: pedidos além do fim partilham a miniatura da última.
+    """
+    st = os.stat(path)
+    fingerprint = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+    base = hashlib.sha256(fingerprint.encode("utf-8", errors="ignore")).hexdigest()
+    return f"{base}_p{_clamp_page(path, page, fingerprint)}_w{width}"
+
+
+def render_preview(path: str, page: int, width: int):
+    """Gera a miniatura (PIL.Image) da página `page` (1 = primeira)."""
+    from PIL import Image
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".pdf":
+        import pypdfium2
+
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            index = max(0, min(page - 1, len(pdf) - 1))
+            pdf_page = pdf[index]
+            scale = width / max(pdf_page.get_width(), 1)
+            img = pdf_page.render(scale=scale).to_pil()
+        finally:
+            pdf.close()
+    else:
+        img = Image.open(path)
+        if getattr(img, "n_frames", 1) > 1:
+            img.seek(max(0, min(page - 1, img.n_frames - 1)))
+        img.draft("RGB", (width, width * 4))
+        img = img.convert("RGB")
+        img.thumbnail((width, width * 4))
+    return img
+
+
+def get_preview(path: str, page: int = 1, width: int = DEFAULT_WIDTH) -> tuple[str, str, bool]:
+    """
+    Devolve (caminho_da_miniatura, chave, hit_na_cache).
+    Gera e grava a miniatura se ainda não existir.
+    """
+    global _writes_since_evict
+
+    width = clamp_width(width)
+    page = max(1, int(page or 1))
+    key = preview_key(path, page, width)
+    fmt, ext = preview_format()
+    cache_path = os.path.join(PREVIEW_DIR, key[:2], f"{key}.{ext}")
+
+    if os.path.exists(cache_path):
+        try:
+            os.utime(cache_path)  # marca como usado recentemente (LRU)
+        except OSError:
+            pass
+        return cache_path, key, True
+
+    img = render_preview(path, page, width)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp = f"{cache_path}.{threading.get_ident()}.tmp"
+    if fmt == "WEBP":
+        img.save(tmp, fmt, quality=70)
+    else:
+        img.save(tmp, fmt, optimize=True)
+    os.replace(tmp, cache_path)
+
+    with _lock:
+        _writes_since_evict += 1
+        run_evict = _writes_since_evict >= _EVICT_EVERY
+        if run_evict:
+            _writes_since_evict = 0
+    if run_evict:
+        evict_previews()
+    return cache_path, key, False
+
+
+def evict_previews(max_bytes: int | None = None):
+    """Remove as miniaturas menos usadas até a cache ficar a 90% do limite."""
+    max_bytes = PREVIEW_CACHE_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    entries = []
+    total = 0
+    for root, _, files in os.walk(PREVIEW_DIR):
+        for name in files:
+            full = os.path.join(root, name)
+            try:
+                st = os.stat(full)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, full))
+            total += st.st_size
+
+    if total <= max_bytes:
+        return
+    target = int(max_bytes * 0.9)
+    for _, size, full in sorted(entries):
+        try:
+            os.remove(full)
+            total -= size
+        except OSError:
+            pass
+        if total <= target:
+            break
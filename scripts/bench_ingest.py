@@ -0,0 +1,241 @@
+"""
+Benchmarks da extração (ingest) sobre ficheiros sintéticos.
+
+    python scripts/bench_ingest.py spreadsheets --rows 50000
+        Folhas de cálculo: leitura nativa (openpyxl) vs Tika.
+    python scripts/bench_ingest.py ocr --docs 20
+        OCR de faturas sintéticas (inclinadas, com ruído): tempo e recall
+        de entidades com e sem pré-processamento de imagem.
+    python scripts/bench_ingest.py startup
+        Tempo de arranque de ingest.py e search_cli.py (-X importtime).
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, BASE_DIR)
+
+
+def _timed(fn, *args, trace_memory: bool = False):
+    """
+    (resultado, segundos, pico de memória Python em MB ou None).
+    A memória é medida numa segunda execução, porque o tracemalloc abranda muito o código.
+    """
+    t0 = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - t0
+
+    peak_mb = None
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            fn(*args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peak_mb = peak / 1024 / 1024
+    return result, elapsed, peak_mb
+
+
+def _fmt_mem(peak_mb) -> str:
+    return f"pico {peak_mb:>7.1f} MB" if peak_mb is not None else ""
+
+
+# ---------------- Folhas de cálculo ----------------
+def make_workbook(path: str, rows: int, sheets: int = 3):
+    """Livro sintético: linhas de faturas + linha de total por folha."""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    for s in range(sheets):
+        ws = wb.create_sheet(f"Faturas {2022 + s}")
+        ws.append(["Data", "Fornecedor", "NIF", "Nº Fatura", "Valor"])
+        total = 0.0
+        for i in range(rows // sheets):
+            value = round((i % 997) * 1.37, 2)
+            total += value
+            ws.append([f"2024-{i % 12 + 1:02d}-15", f"Fornecedor {i % 50}", 500000000 + i % 50,
+                       f"FT 2024/{i}", value])
+        ws.append(["", "", "", "Total", round(total, 2)])
+    wb.save(path)
+
+
+def bench_spreadsheets(args):
+    from parsers.spreadsheet_parser import parse_spreadsheet
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.xlsx")
+        make_workbook(path, args.rows)
+        print(f"Livro: {args.rows} linhas, {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+
+        result, secs, peak = _timed(parse_spreadsheet, path, trace_memory=args.memory)
+        print(f"{'nativo (openpyxl)':<20} {secs:>8.2f}s  {_fmt_mem(peak)}  "
+              f"{len(result['text'])} chars  truncado={result['truncated']}")
+
+        if args.skip_tika:
+            return
+        import ingest
+
+        text, secs, peak = _timed(ingest.extract_text_with_tika, path, trace_memory=args.memory)
+        status = f"{len(text)} chars" if text else "falhou (Tika indisponível?)"
+        print(f"{'Tika':<20} {secs:>8.2f}s  {_fmt_mem(peak)}  {status}")
+
+
+# ---------------- OCR ----------------
+def make_invoice_image(rnd, dpi: int = 600):
+    """Fatura sintética "digitalizada": (imagem, entidades esperadas)."""
+    import numpy as np
+    from PIL import Image, ImageDraw, ImageFont
+
+    expected = {
+        "nif": str(rnd.choice([5, 2, 1]) * 100000000 + rnd.randrange(10_000_000, 99_999_999)),
+        "invoice_no": f"FT 2024/{rnd.randrange(1, 9999)}",
+        "date": f"{rnd.randrange(1, 28):02d}-{rnd.randrange(1, 12):02d}-2024",
+        "total": round(rnd.uniform(10, 5000), 2),
+    }
+    scale = dpi / 300
+    w, h = int(2480 * scale), int(3508 * scale)
+    img = Image.new("L", (w, h), 235)
+    draw = ImageDraw.Draw(img)
+    try:
+        font = ImageFont.truetype("DejaVuSans.ttf", int(36 * scale))
+    except OSError:
+        font = ImageFont.load_default()
+    total = f"{expected['total']:,.2f}".replace(",", " ").replace(".", ",").replace(" ", ".")
+    lines = [
+        "Empresa Exemplo, Lda",
+        f"NIF: {expected['nif']}",
+        f"Fatura nº {expected['invoice_no']}",
+        f"Data: {expected['date']}",
+        "",
+        *[f"Artigo {i}    1 un    {rnd.uniform(1, 99):.2f}" for i in range(12)],
+        "",
+        f"Total: {total} €",
+    ]
+    y = int(300 * scale)
+    for line in lines:
+        draw.text((int(250 * scale), y), line, fill=20, font=font)
+        y += int(60 * scale)
+
+    img = img.rotate(rnd.uniform(-3, 3), resample=Image.BICUBIC, fillcolor=235)
+    arr = np.asarray(img, dtype=np.int16) + np.random.default_rng(rnd.randrange(1 << 30)).normal(
+        0, 18, (h, w)).astype(np.int16)
+    img = Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8))
+    img.info["dpi"] = (dpi, dpi)
+    return img, expected
+
+
+def _entity_hits(found: dict, expected: dict) -> int:
+    hits = 0
+    hits += found.get("nif") == expected["nif"]
+    hits += (found.get("invoice_no_norm") or "").endswith(expected["invoice_no"].split()[-1].replace("/", ""))
+    hits += found.get("date") == expected["date"]
+    hits += found.get("total") is not None and abs(found["total"] - expected["total"]) < 0.01
+    return int(hits)
+
+
+def bench_ocr(args):
+    import random
+    import shutil
+
+    if not shutil.which("tesseract"):
+        sys.exit("tesseract não está instalado")
+    import ingest
+    from parsers import image_preprocess, ocr_engine
+
+    rnd = random.Random(args.seed)
+    corpus = [make_invoice_image(rnd) for _ in range(args.docs)]
+    print(f"Corpus: {len(corpus)} faturas a 600 DPI, inclinação ±3°, com ruído")
+    print(f"Motor OCR: {ocr_engine.get_engine().name} (OCR_ENGINE para mudar)")
+
+    for profile in ["off", *args.profiles]:
+        t0 = time.perf_counter()
+        hits = 0
+        confs = []
+        for img, expected in corpus:
+            if args.ladder:
+                text, conf = ingest.ocr_ladder(lambda dpi: img, profile)
+                confs.append(conf)
+            else:
+                text = ingest.tesseract_text(img.copy(), profile)
+            hits += _entity_hits(ingest.extract_entities(text), expected)
+        secs = time.perf_counter() - t0
+        recall = hits / (4 * len(corpus))
+        conf = ingest.mean_confidence(confs)
+        print(f"{profile:<8} {secs:>8.2f}s  {secs / len(corpus):>6.2f}s/doc  recall {recall:6.1%}"
+              + (f"  conf {conf}" if conf is not None else ""))
+    print(f"(perfis disponíveis: {', '.join(image_preprocess.PROFILES)})")
+
+
+# ---------------- Arranque ----------------
+def _importtime(code: str):
+    """(segundos de parede, [(cumulativo_us, módulo)]) de `python -X importtime -c code`."""
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BASE_DIR, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        sys.exit(proc.stderr[-2000:])
+    modules = []
+    for line in proc.stderr.splitlines():
+        # "import time:   self [us] | cumulative | imported package"
+        parts = line.removeprefix("import time:").split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            name = parts[2].rstrip()
+            if not name.startswith("  "):  # só imports de topo (o cumulativo inclui os filhos)
+                modules.append((int(parts[1]), name.strip()))
+    return wall, sorted(modules, reverse=True)
+
+
+def bench_startup(args):
+    cases = [
+        ("ingest.py", "import ingest"),
+        ("search_cli.py", "import search_cli"),
+        ("ingest + 1º ficheiro", "import ingest, pdfplumber, pypdfium2; ingest.get_es()"),
+    ]
+    for label, code in cases:
+        walls = []
+        for _ in range(args.runs):
+            wall, modules = _importtime(code)
+            walls.append(wall)
+        walls.sort()
+        print(f"{label:<22} mediana {walls[len(walls) // 2] * 1000:>7.0f} ms (processo completo)")
+        for cumulative, name in modules[:args.top]:
+            print(f"    {cumulative / 1000:>8.1f} ms  {name}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmarks de extração DocSearch PT")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    sp = sub.add_parser("spreadsheets", help="openpyxl vs Tika")
+    sp.add_argument("--rows", type=int, default=50_000)
+    sp.add_argument("--skip-tika", action="store_true")
+    sp.add_argument("--memory", action="store_true", help="medir também o pico de memória (tracemalloc)")
+    sp.set_defaults(func=bench_spreadsheets)
+
+    op = sub.add_parser("ocr", help="OCR com/sem pré-processamento")
+    op.add_argument("--docs", type=int, default=20)
+    op.add_argument("--seed", type=int, default=42)
+    op.add_argument("--profiles", nargs="+", default=["scan", "photo"])
+    op.add_argument("--ladder", action="store_true", help="usar a escada de qualidade (OCR_LADDER)")
+    op.set_defaults(func=bench_ocr)
+
+    st = sub.add_parser("startup", help="tempo de arranque e imports mais pesados")
+    st.add_argument("--runs", type=int, default=5)
+    st.add_argument("--top", type=int, default=5)
+    st.set_defaults(func=bench_startup)
+
+    args = ap.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
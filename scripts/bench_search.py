@@ -0,0 +1,285 @@
+"""
+Benchmark de latência das pesquisas sobre um índice sintético.
+
+Cria (se necessário) um índice de teste com N documentos falsos distribuídos
+por várias pastas e mede a latência de pesquisas repetidas com cada variante
+de query. Uso:
+
+    python scripts/bench_search.py --docs 100000 --repeat 50
+    python scripts/bench_search.py --cases folder_must,folder_filter
+
+Para medir o custo do texto por página (page_texts), comparar dois índices:
+
+    python scripts/bench_search.py --index files_bench --cases text_single
+    python scripts/bench_search.py --index files_bench_pages --page-texts \
+        --cases text_single,text_pages
+
+O índice de teste NÃO é o índice de produção (por defeito 'files_bench').
+Depois de mudar o mapping em ingest.ensure_index, apagar o índice de teste
+(--drop) para que seja recriado com os analyzers atuais.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import bulk
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, BASE_DIR)
+
+from ingest import ensure_index, strip_accents  # noqa: E402
+
+ES_URL = os.environ.get("ES_URL", "http://localhost:9200")
+
+FOLDERS = [f"/bench/clientes/cliente_{i:03d}" for i in range(50)]
+SUPPLIERS = [
+    "Energias de Portugal SA", "Águas do Porto EM", "Galp Energia",
+    "Bolt Operations OÜ", "Continente Hipermercados", "Vodafone Portugal",
+    "MEO Serviços de Comunicações", "Fnac Portugal", "Worten Equipamentos",
+    "Pingo Doce Distribuição",
+]
+WORDS = (
+    "fatura recibo serviço fornecimento energia água comunicações transporte "
+    "manutenção consultoria contabilidade pagamento referência cliente total "
+    "iva base imposto período faturação débito crédito nota"
+).split()
+
+
+# ---------------- Dados sintéticos ----------------
+def fake_doc(i: int, rnd: random.Random, page_texts: bool = False) -> dict:
+    folder = rnd.choice(FOLDERS)
+    supplier = rnd.choice(SUPPLIERS)
+    year = rnd.randint(2019, 2025)
+    month = rnd.randint(1, 12)
+    day = rnd.randint(1, 28)
+    total = round(rnd.uniform(1, 5000), 2)
+    n_pages = rnd.randint(1, 6)
+    pages = [
+        " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(20, 80)))
+        for _ in range(n_pages)
+    ]
+    texto = "\n\n".join(pages)
+    filename = f"Fatura {supplier.split()[0]} FT{year}-{i}.pdf"
+    doc = {
+        "filename": filename,
+        "filename_edge": filename,
+        "extension": "pdf",
+        "path": f"{folder}/{filename}",
+        "texto": texto,
+        "texto_edge": texto,
+        "entities": {
+            "nif": f"5{rnd.randint(0, 99999999):08d}",
+            "iban": f"PT50{rnd.randint(0, 10**21 - 1):021d}",
+            "date": f"{year:04d}-{month:02d}-{day:02d}",
+            "total": total,
+            "invoice_no": f"FT {year}/{i}",
+            "supplier": supplier,
+        },
+        "indexed_at": f"{year:04d}-{month:02d}-{day:02d}T12:00:00",
+        "year": year,
+        "month": month,
+        "quarter": (month - 1) // 3 + 1,
+        "pages": n_pages,
+    }
+    if page_texts:
+        doc["page_texts"] = [{"page": n, "text": t} for n, t in enumerate(pages, start=1)]
+    return doc
+
+
+def seed_index(es: Elasticsearch, index: str, n_docs: int, seed: int = 42,
+               page_texts: bool = False):
+    ensure_index(es, index, partitioned=False)
+    existing = es.count(index=index)["count"]
+    if existing >= n_docs:
+        print(f"[INFO] Índice '{index}' já tem {existing} documentos.")
+        return
+
+    rnd = random.Random(seed)
+    t0 = time.perf_counter()
+    actions = (
+        {"_index": index, "_id": str(i), "_source": fake_doc(i, rnd, page_texts)}
+        for i in range(existing, n_docs)
+    )
+    bulk(es, actions, chunk_size=2000, request_timeout=120)
+    es.indices.refresh(index=index)
+    es.indices.forcemerge(index=index, max_num_segments=1, request_timeout=600)
+    print(f"[INFO] {n_docs - existing} documentos criados em {time.perf_counter() - t0:.1f}s")
+
+
+# ---------------- Variantes de query ----------------
+def _folder_clauses(params: dict) -> tuple[list, list]:
+    """(restrições, cláusulas com score) de uma pesquisa limitada à pasta."""
+    constraints = [
+        {"prefix": {"path.keyword": params["folder"]}},
+        {"range": {"entities.date": {"gte": params["date_from"], "lte": params["date_to"]}}},
+        {"range": {"entities.total": {"gte": params["min_total"]}}},
+    ]
+    scoring = [{"match": {"texto": {"query": params["word"]}}}]
+    return constraints, scoring
+
+
+def case_folder_must(params: dict) -> dict:
+    # Layout antigo: tudo em must (pontuado, sem filter cache)
+    constraints, scoring = _folder_clauses(params)
+    return {"bool": {"must": constraints + scoring}}
+
+
+def case_folder_filter(params: dict) -> dict:
+    # Layout atual: restrições em filter, só o texto pontua
+    constraints, scoring = _folder_clauses(params)
+    return {"bool": {"must": scoring, "filter": constraints}}
+
+
+def _name_should(params: dict, fuzzy: bool) -> list:
+    extra = {"fuzziness": "AUTO"} if fuzzy else {}
+    query = params["supplier_ascii"]
+    return [
+        {"match": {"entities.supplier": {"query": query, "boost": 3, **extra}}},
+        {"match": {"entities.client": {"query": query, "boost": 3, **extra}}},
+        {"match": {"texto": {"query": query, "boost": 1, **extra}}},
+        {"match": {"filename_edge": {"query": query, "boost": 3}}},
+    ]
+
+
+def case_name_fuzzy(params: dict) -> dict:
+    # Layout antigo: tolerância a acentos à custa de fuzziness AUTO
+    return {
+        "bool": {
+            "should": _name_should(params, fuzzy=True),
+            "minimum_should_match": 1,
+            "filter": [{"prefix": {"path.keyword": params["folder"]}}],
+        }
+    }
+
+
+def case_name_folded(params: dict) -> dict:
+    # Layout atual: analyzer pt_folded, termos exatos
+    return {
+        "bool": {
+            "should": _name_should(params, fuzzy=False),
+            "minimum_should_match": 1,
+            "filter": [{"prefix": {"path.keyword": params["folder"]}}],
+        }
+    }
+
+
+def case_text_single(params: dict) -> dict:
+    # Layout de um só campo: texto completo, sem página
+    return {
+        "bool": {
+            "should": [{"match": {"texto": {"query": params["word"]}}}],
+            "minimum_should_match": 1,
+            "filter": [{"prefix": {"path.keyword": params["folder"]}}],
+        }
+    }
+
+
+def case_text_pages(params: dict) -> dict:
+    # Texto completo + nested page_texts com inner_hits (página do resultado)
+    query = case_text_single(params)
+    query["bool"]["should"].append(
+        {
+            "nested": {
+                "path": "page_texts",
+                "query": {"match": {"page_texts.text": {"query": params["word"]}}},
+                "score_mode": "max",
+                "boost": 0.5,
+                "ignore_unmapped": True,
+                "inner_hits": {
+                    "size": 1,
+                    "_source": False,
+                    "docvalue_fields": ["page_texts.page"],
+                    "highlight": {"fields": {"page_texts.text": {"fragment_size": 200, "number_of_fragments": 1}}},
+                },
+            }
+        }
+    )
+    return query
+
+
+CASES = {
+    "folder_must": case_folder_must,
+    "folder_filter": case_folder_filter,
+    "name_fuzzy": case_name_fuzzy,
+    "name_folded": case_name_folded,
+    "text_single": case_text_single,
+    "text_pages": case_text_pages,
+}
+
+
+def random_params(rnd: random.Random) -> dict:
+    year = rnd.randint(2019, 2025)
+    supplier = rnd.choice(SUPPLIERS)
+    return {
+        # Poucas pastas repetidas, como um utilizador a trabalhar numa pasta
+        "folder": rnd.choice(FOLDERS[:3]),
+        "date_from": f"{year}-01-01",
+        "date_to": f"{year}-12-31",
+        "min_total": rnd.choice([10, 50, 100]),
+        "word": rnd.choice(WORDS),
+        "supplier": supplier,
+        # Como o utilizador escreve: minúsculas e sem acentos
+        "supplier_ascii": strip_accents(supplier.lower()),
+    }
+
+
+def run_case(es: Elasticsearch, index: str, name: str, repeat: int, size: int) -> dict:
+    es.indices.clear_cache(index=index)
+    rnd = random.Random(7)  # mesma sequência de pesquisas para todas as variantes
+    took, wall = [], []
+    for _ in range(repeat):
+        body = {
+            "query": CASES[name](random_params(rnd)),
+            "_source": ["filename", "path", "entities"],
+            "highlight": {"fields": {"texto": {"fragment_size": 200, "number_of_fragments": 1}}},
+            "sort": [{"_score": {"order": "desc"}}, {"indexed_at": {"order": "desc"}}],
+        }
+        t0 = time.perf_counter()
+        res = es.search(index=index, size=size, body=body, request_cache=False)
+        wall.append((time.perf_counter() - t0) * 1000)
+        took.append(res["took"])
+    return {
+        "case": name,
+        "took_p50": statistics.median(took),
+        "took_p95": sorted(took)[int(len(took) * 0.95) - 1],
+        "wall_p50": statistics.median(wall),
+        "wall_mean": statistics.fmean(wall),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark de pesquisa DocSearch PT")
+    ap.add_argument("--index", default="files_bench")
+    ap.add_argument("--docs", type=int, default=100_000)
+    ap.add_argument("--repeat", type=int, default=50)
+    ap.add_argument("--size", type=int, default=50)
+    ap.add_argument("--cases", default=",".join(CASES))
+    ap.add_argument("--page-texts", action="store_true",
+                    help="gerar também page_texts (comparar com um índice sem eles)")
+    ap.add_argument("--drop", action="store_true", help="apagar o índice de teste no fim")
+    args = ap.parse_args()
+
+    es = Elasticsearch(ES_URL, request_timeout=60)
+    seed_index(es, args.index, args.docs, page_texts=args.page_texts)
+
+    store = es.indices.stats(index=args.index, metric="store")["_all"]["primaries"]["store"]
+    print(f"[INFO] Tamanho do índice '{args.index}': {store['size_in_bytes'] / 1024 / 1024:.1f} MB")
+
+    print(f"{'caso':<22} {'took p50':>9} {'took p95':>9} {'wall p50':>9} {'wall avg':>9}  (ms)")
+    for name in args.cases.split(","):
+        r = run_case(es, args.index, name.strip(), args.repeat, args.size)
+        print(
+            f"{r['case']:<22} {r['took_p50']:>9.1f} {r['took_p95']:>9.1f} "
+            f"{r['wall_p50']:>9.1f} {r['wall_mean']:>9.1f}"
+        )
+
+    if args.drop:
+        es.indices.delete(index=args.index)
+
+
+if __name__ == "__main__":
+    main()
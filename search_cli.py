@@ -1,32 +1,46 @@
-from elasticsearch import Elasticsearch
+import json
+import os
 import sys
+import urllib.request
 
-ES_URL = "http://localhost:9200"
-INDEX = "files"
+ES_URL = os.environ.get("ES_URL", "http://localhost:9200")
+INDEX = os.environ.get("ES_INDEX", "files")
 
-def search(es, q, size=10):
+
+def search(q, size=10):
+    # Um único pedido HTTP: o cliente `elasticsearch` demora mais a importar
+    # do que a própria pesquisa
     body = {
+        "size": size,
         "query": {
             "multi_match": {
                 "query": q,
-                "fields": ["filename^3", "text"]
+                "fields": ["filename^3", "texto"]
             }
         },
         "_source": ["filename", "path", "entities", "language"]
     }
-    res = es.search(index=INDEX, size=size, body=body)
+    req = urllib.request.Request(
+        f"{ES_URL.rstrip('/')}/{INDEX}/_search",
+        data=json.dumps(body).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        res = json.load(resp)
     return res["hits"]["hits"]
 
+
 def main():
     if len(sys.argv) < 2:
-        print("Uso: python search_cli.py "termo de pesquisa"")
+        print('Uso: python search_cli.py "termo de pesquisa"')
         sys.exit(1)
     q = sys.argv[1]
-    es = Elasticsearch(ES_URL)
-    hits = search(es, q)
+    hits = search(q)
     for h in hits:
         src = h["_source"]
         print(f"{h['_score']:.2f} | {src.get('filename')} | {src.get('path')} | ENT:{src.get('entities')} | LANG:{src.get('language')}")
 
+
 if __name__ == "__main__":
     main()
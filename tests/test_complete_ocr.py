@@ -0,0 +1,97 @@
+"""
+OCR completo diferido (complete_ocr_doc) com INGEST_TEXT_OVERFLOW=split:
+o texto acima do limite vai para continuações, as entidades vêm de todas
+as páginas e o spool temporário é apagado. O OCR e o Elasticsearch são
+substituídos por falsos.
+
+    python -m pytest -q tests
+"""
+import functools
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ingest  # noqa: E402
+
+PAGES = [
+    "Fatura FT 2024/7 de 05/03/2024 " + "a" * 60,
+    "b" * 80,
+    "NIF 123456789 Total: 1.234,56 " + "c" * 60,
+]
+
+
+class FakeES:
+    def __init__(self):
+        self.updates = []
+        self.indexed = {}
+        self.deleted_by_query = []
+
+    def update(self, index, id, doc):
+        self.updates.append((index, id, doc))
+
+    def index(self, index, id, document):
+        self.indexed[id] = (index, document)
+
+    def delete_by_query(self, index, query, conflicts):
+        self.deleted_by_query.append((index, query))
+
+
+def fake_ocr_pdf(path, fast=None, collector=None, has_native=None):
+    for text in PAGES:
+        collector.add(text, 90.0)
+    return collector.text, "tesseract", collector.mean_conf, collector.page_texts, collector.page_confs
+
+
+@pytest.fixture
+def env(monkeypatch, tmp_path):
+    es = FakeES()
+    monkeypatch.setattr(ingest, "get_es", lambda: es)
+    monkeypatch.setattr(ingest, "ocr_pdf", fake_ocr_pdf)
+    monkeypatch.setattr(ingest, "TEXT_OVERFLOW", "split")
+    monkeypatch.setattr(ingest, "TextCollector",
+                        functools.partial(ingest.TextCollector, max_chars=100, overflow="split"))
+    monkeypatch.setattr(ingest.index_partitions, "PARTITION_BY_YEAR", False)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    pdf = tmp_path / "scan.pdf"
+    pdf.write_bytes(b"%PDF")
+    return es, str(pdf), tmp_path
+
+
+def test_split_mode_indexes_continuations_and_removes_spool(env):
+    es, pdf, tmp = env
+    src = {"path": pdf, "filename": "scan.pdf", "entities": {"invoice_no": "FT 2024/7"}, "parts": 0}
+
+    assert ingest.complete_ocr_doc("doc1", src, ingest.INDEX) == "indexed"
+
+    (index, fid, update), = es.updates
+    assert (index, fid) == (ingest.INDEX, "doc1")
+    assert update["text_truncated"] is True
+    assert update["parts"] >= 1
+    assert "123456789" not in update["texto"]
+    # Entidades de páginas que ficaram fora do texto principal
+    assert update["entities"]["nif"] == "123456789"
+    assert update["entities"]["total"] == 1234.56
+    assert update["year"] == 2024
+
+    parts = {k: v for k, v in es.indexed.items() if k.startswith("doc1_p")}
+    assert len(parts) == update["parts"]
+    assert all(doc["part_of"] == "doc1" and doc["filename"] == "scan.pdf" for _, doc in parts.values())
+    assert "NIF 123456789" in " ".join(doc["texto"] for _, doc in parts.values())
+    # Sem continuações antigas a mais: nada a apagar
+    assert es.deleted_by_query == []
+    assert not [f for f in os.listdir(tmp) if f.startswith("docsearch_parts_")]
+
+
+def test_stale_continuations_removed(env):
+    es, pdf, tmp = env
+    src = {"path": pdf, "filename": "scan.pdf", "entities": {}, "parts": 9}
+
+    assert ingest.complete_ocr_doc("doc1", src, ingest.INDEX) == "indexed"
+
+    (index, query), = es.deleted_by_query
+    assert index == ingest.INDEX
+    assert {"term": {"part_of": "doc1"}} in query["bool"]["filter"]
+    assert not [f for f in os.listdir(tmp) if f.startswith("docsearch_parts_")]
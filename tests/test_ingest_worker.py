@@ -0,0 +1,205 @@
+"""
+Leases para workers remotos: vários `ingest_remote.run_worker(once=True)`
+em threads contra um coordenador local (http.server) que expõe as mesmas
+rotas da webapp sobre o ingest_worker. O ingest é substituído por um falso
+que só regista o que seria indexado (sem Elasticsearch nem OCR).
+
+    python -m pytest -q tests
+"""
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ingest  # noqa: E402
+import ingest_remote  # noqa: E402
+import ingest_worker  # noqa: E402
+
+
+class FakeIngest:
+    INDEX = "test"
+    SUPPORTED_EXTS = [".pdf"]
+    BULK_LOAD = False
+    OCR_MODE = "full"
+    OCR_FAST_POLICY = "inline"
+    iter_supported_files = staticmethod(ingest.iter_supported_files)
+    throughput_summary = staticmethod(ingest.throughput_summary)
+
+    def __init__(self):
+        self.indexed = Counter()
+        self.parts = {}
+        self.ocr_listed_by = []
+        self._lock = threading.Lock()
+
+    def is_indexed(self, path):
+        return False
+
+    def bulk_load_active(self):
+        return False
+
+    def get_es(self):
+        class Indices:
+            def refresh(self, index):
+                pass
+
+        class ES:
+            indices = Indices()
+
+        return ES()
+
+    def list_pending_ocr(self):
+        self.ocr_listed_by.append(threading.current_thread().name)
+        return []
+
+    def index_remote_result(self, path, result, spool=None):
+        parts = list(ingest.iter_continuations(spool)) if spool else []
+        with self._lock:
+            self.indexed[path] += 1
+            self.parts[path] = len(parts)
+        return "indexed"
+
+
+class Coordinator(http.server.BaseHTTPRequestHandler):
+    """As rotas /api/ingest/lease* da webapp, sem token."""
+    failures = 0  # nº de pedidos de lease a recusar com 503
+
+    def _reply(self, code, body=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])) or b"{}")
+        parts = self.path.strip("/").split("/")
+        if self.path == "/api/ingest/lease":
+            if Coordinator.failures > 0:
+                Coordinator.failures -= 1
+                return self._reply(503, {"error": "indisponível"})
+            lease = ingest_worker.lease(body["worker"])
+            return self._reply(204) if lease is None else self._reply(200, lease)
+        if parts[-1] == "parts":
+            ok = ingest_worker.add_lease_parts(parts[-2], body["parts"])
+            return self._reply(200 if ok else 410, {})
+        if parts[-1] == "result":
+            status = ingest_worker.complete_lease(parts[-2], body)
+            return self._reply(410 if status is None else 200, {"status": status})
+        self._reply(404, {})
+
+    def log_message(self, *args):
+        pass
+
+
+def fake_extract(path):
+    """Ficheiros com "big" no nome têm duas continuações."""
+    time.sleep(0.01)
+    spool = None
+    if "big" in os.path.basename(path):
+        chunk = [{"page": 1, "text": "x", "conf": None}]
+        fd, spool = tempfile.mkstemp(suffix=".jsonl")
+        with os.fdopen(fd, "w") as fh:
+            fh.write(json.dumps(chunk) + "\n" + json.dumps(chunk) + "\n")
+    return {"doc": {"filename": os.path.basename(path)}}, spool
+
+
+@pytest.fixture
+def setup(monkeypatch, tmp_path):
+    fake = FakeIngest()
+    monkeypatch.setattr(ingest_worker, "_ingest", fake)
+    monkeypatch.setattr(ingest_worker, "LOCAL_WORKER", False)
+    monkeypatch.setattr(ingest_worker, "LEASE_TTL_S", 0.5)
+    monkeypatch.setattr(ingest_remote, "extract", fake_extract)
+    monkeypatch.setattr(ingest_remote, "SHARED_PATHS", True)
+    monkeypatch.setattr(ingest_remote, "POLL_S", 0.01)
+    Coordinator.failures = 0
+
+    folder = tmp_path / "incoming"
+    folder.mkdir()
+    files = []
+    for i in range(30):
+        path = folder / (f"big{i}.pdf" if i % 5 == 0 else f"doc{i}.pdf")
+        path.write_bytes(b"%PDF")
+        files.append(str(path))
+    (folder / "notas.txt").write_text("não suportado")
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Coordinator)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield fake, str(folder), files, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def run_workers(url, n):
+    threads = [threading.Thread(target=ingest_remote.run_worker, args=(url, True)) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=30)
+    assert not any(t.is_alive() for t in threads)
+
+
+def wait_finished(job, timeout=5):
+    deadline = time.time() + timeout
+    while not job.finished_at and time.time() < deadline:
+        time.sleep(0.02)
+
+
+def test_each_file_indexed_once_and_expired_lease_redispatched(setup):
+    fake, folder, files, url = setup
+    job = ingest_worker.submit("t-leases", folder=folder)
+
+    # Um worker que morre a meio: a lease expira e o ficheiro volta à fila
+    abandoned = ingest_worker.lease("morto")
+    assert abandoned is not None
+    time.sleep(ingest_worker.LEASE_TTL_S + 0.1)
+
+    run_workers(url, 4)
+    wait_finished(job)
+
+    assert job.status == "completed"
+    assert sorted(fake.indexed) == sorted(files)
+    assert set(fake.indexed.values()) == {1}
+    assert job.done == len(files)
+    assert fake.parts[abandoned["path"]] == (2 if "big" in abandoned["filename"] else 0)
+    assert all(fake.parts[p] == 2 for p in files if "big" in os.path.basename(p))
+
+    # O resultado atrasado do worker que "morreu" é recusado
+    assert ingest_worker.complete_lease(abandoned["lease_id"], {"doc": {}}) is None
+    assert fake.indexed[abandoned["path"]] == 1
+
+
+def test_worker_backs_off_on_coordinator_errors(setup):
+    fake, folder, files, url = setup
+    job = ingest_worker.submit("t-backoff", folder=folder)
+    Coordinator.failures = 3
+
+    run_workers(url, 2)
+    wait_finished(job)
+
+    assert Coordinator.failures == 0
+    assert job.status == "completed"
+    assert sorted(fake.indexed) == sorted(files)
+    assert set(fake.indexed.values()) == {1}
+
+
+def test_lease_does_not_start_jobs_remote_workers_cannot_take(setup):
+    fake, folder, files, url = setup
+    ingest_worker.start()
+    ingest_worker._submit_complete_ocr()
+    job = ingest_worker._ocr_job
+    for _ in range(20):
+        assert ingest_worker.lease("remoto") is None
+    wait_finished(job)
+
+    # Só a thread local arranca o OCR completo (refresh + listagem)
+    assert job.status == "completed"
+    assert fake.ocr_listed_by == ["ingest-worker"]
@@ -0,0 +1,45 @@
+"""
+Cache de miniaturas: páginas pedidas além do fim de um PDF curto partilham
+a miniatura da última página.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import previews  # noqa: E402
+
+pypdfium2 = pytest.importorskip("pypdfium2")
+
+
+@pytest.fixture
+def pdf(tmp_path, monkeypatch):
+    monkeypatch.setattr(previews, "PREVIEW_DIR", str(tmp_path / "cache"))
+    path = tmp_path / "duas.pdf"
+    doc = pypdfium2.PdfDocument.new()
+    doc.new_page(200, 300)
+    doc.new_page(200, 300)
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+def test_pages_past_the_end_share_the_last_page_key(pdf):
+    keys = {previews.preview_key(pdf, page, 100) for page in (2, 3, 7, 50)}
+    assert len(keys) == 1
+    assert keys.pop().endswith("_p2_w100")
+    assert previews.preview_key(pdf, 1, 100).endswith("_p1_w100")
+    assert previews.preview_key(pdf, 0, 100).endswith("_p1_w100")
+
+
+def test_pages_past_the_end_render_once(pdf):
+    _, key, hit = previews.get_preview(pdf, 2, 100)
+    assert not hit
+    for page in (3, 9):
+        _, same_key, hit = previews.get_preview(pdf, page, 100)
+        assert hit and same_key == key
+    stored = [f for _, _, files in os.walk(previews.PREVIEW_DIR) for f in files]
+    assert len(stored) == 1
@@ -0,0 +1,129 @@
+"""
+Testes do cliente Tika contra um servidor HTTP local (http.server) que
+imita as respostas do Tika: 200, 422, 500 e resposta lenta (timeout).
+
+    python -m pytest -q tests
+"""
+import http.server
+import os
+import sys
+import threading
+import time
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from parsers import tika_client  # noqa: E402
+
+
+class StubTika(http.server.BaseHTTPRequestHandler):
+    mode = "ok"          # "ok" | "422" | "500" | "slow"
+    last_disposition = None
+
+    def do_PUT(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        StubTika.last_disposition = self.headers.get("Content-Disposition")
+        if StubTika.mode == "slow":
+            time.sleep(1.0)
+        if StubTika.mode in ("422", "500"):
+            self.send_response(int(StubTika.mode))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        text = ("texto: " + body.decode("utf-8", errors="replace")).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(text)))
+        self.end_headers()
+        try:
+            self.wfile.write(text)
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def tika(monkeypatch):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubTika)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    StubTika.mode = "ok"
+    monkeypatch.setattr(tika_client, "TIKA_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setattr(tika_client, "TIKA_TIMEOUT", 0.3)
+    monkeypatch.setattr(tika_client, "TIKA_BREAKER_FAILURES", 3)
+    monkeypatch.setattr(tika_client, "TIKA_BREAKER_COOLDOWN", 0.3)
+    monkeypatch.setattr(tika_client, "_failures", 0)
+    monkeypatch.setattr(tika_client, "_open_until", 0.0)
+    monkeypatch.setattr(tika_client, "_session", None)
+    yield StubTika
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def doc(tmp_path):
+    path = tmp_path / "fatura “FT 1” €.pdf"
+    path.write_bytes(b"conteudo")
+    return str(path)
+
+
+def test_200_returns_text(tika, doc):
+    assert tika_client.extract_text(doc) == "texto: conteudo"
+    assert "filename*=UTF-8''fatura%20%E2%80%9CFT%201%E2%80%9D%20%E2%82%AC.pdf" in tika.last_disposition
+
+
+def test_max_chars_caps_text(tika, doc):
+    assert tika_client.extract_text(doc, max_chars=5) == "texto"
+
+
+def test_422_is_empty_text_and_not_a_failure(tika, doc):
+    tika.mode = "422"
+    for _ in range(tika_client.TIKA_BREAKER_FAILURES + 1):
+        assert tika_client.extract_text(doc) == ""
+    assert not tika_client.breaker_open()
+
+
+def test_timeout_counts_as_failure(tika, doc):
+    tika.mode = "slow"
+    with pytest.raises(requests.Timeout):
+        tika_client.extract_text(doc)
+    assert tika_client._failures == 1
+
+
+def test_missing_file_does_not_open_breaker(tika, tmp_path):
+    for _ in range(tika_client.TIKA_BREAKER_FAILURES + 1):
+        with pytest.raises(FileNotFoundError):
+            tika_client.extract_text(str(tmp_path / "nao-existe.pdf"))
+    assert tika_client._failures == 0
+    assert not tika_client.breaker_open()
+
+
+def test_breaker_opens_and_recovers_half_open(tika, doc):
+    tika.mode = "500"
+    for _ in range(tika_client.TIKA_BREAKER_FAILURES):
+        with pytest.raises(requests.HTTPError):
+            tika_client.extract_text(doc)
+    assert tika_client.breaker_open()
+    with pytest.raises(tika_client.TikaUnavailable):
+        tika_client.extract_text(doc)
+
+    # Depois do cooldown o pedido seguinte passa (half-open) e fecha o breaker
+    tika.mode = "ok"
+    time.sleep(tika_client.TIKA_BREAKER_COOLDOWN + 0.05)
+    assert tika_client.extract_text(doc) == "texto: conteudo"
+    assert tika_client._failures == 0
+    assert not tika_client.breaker_open()
+
+
+def test_half_open_failure_reopens(tika, doc):
+    tika.mode = "500"
+    for _ in range(tika_client.TIKA_BREAKER_FAILURES):
+        with pytest.raises(requests.HTTPError):
+            tika_client.extract_text(doc)
+    time.sleep(tika_client.TIKA_BREAKER_COOLDOWN + 0.05)
+    with pytest.raises(requests.HTTPError):
+        tika_client.extract_text(doc)
+    assert tika_client.breaker_open()
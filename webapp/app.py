@@ -1,4 +1,4 @@
-from fastapi.responses import FileResponse, Response, JSONResponse
+from fastapi.responses import FileResponse, Response, JSONResponse, PlainTextResponse, StreamingResponse
 import mimetypes
 from fastapi import FastAPI, UploadFile, File, Request
 from fastapi.responses import HTMLResponse
@@ -9,15 +9,21 @@ from jinja2 import Environment, FileSystemLoader, ChoiceLoader, select_autoescap
 import uvicorn
 import os
 import sys
-import subprocess
 import uuid
 import re
 import json
 import threading
-import unicodedata
-from urllib.parse import unquote
+import time
+import hashlib
+import hmac
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote, unquote
 from pathlib import Path
 
+import metrics
+
 ES_URL = os.environ.get("ES_URL", "http://127.0.0.1:9200")
 INDEX = os.environ.get("ES_INDEX", "files")
 
@@ -26,6 +32,15 @@ WEB_DIR = os.path.dirname(__file__)
 BASE_DIR = os.path.abspath(os.path.join(WEB_DIR, os.pardir))
 INCOMING_DIR = os.path.join(BASE_DIR, "incoming")
 
+# Módulos partilhados com o ingest.py (raiz do projeto)
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+import previews  # noqa: E402
+import index_partitions  # noqa: E402
+import ingest_worker  # noqa: E402
+# A mesma normalização do nº de fatura na indexação e na pesquisa
+from ingest import normalize_invoice_no  # noqa: E402
+
 # Configuração da pasta por defeito (persistente em config.json)
 CONFIG_PATH = os.path.join(BASE_DIR, "config.json")
 
@@ -57,6 +72,20 @@ os.makedirs(DEFAULT_FOLDER, exist_ok=True)
 
 SUPPORTED_EXTS = [".pdf", ".png", ".jpg", ".jpeg", ".tiff", ".tif", ".xlsx", ".xls"]
 
+# Localizar a página do resultado (campo nested page_texts, ver ingest.PAGE_TEXT_INDEX)
+PAGE_TEXT_SEARCH = os.environ.get("PAGE_TEXT_INDEX", "1") == "1"
+
+# Uploads: gravação aos blocos e limites de tamanho
+UPLOAD_CHUNK = 1024 * 1024
+MAX_UPLOAD_FILE_MB = int(os.environ.get("MAX_UPLOAD_FILE_MB", "200"))
+MAX_UPLOAD_REQUEST_MB = int(os.environ.get("MAX_UPLOAD_REQUEST_MB", "1024"))
+# Não gravar/indexar uploads cujo conteúdo (SHA-256) já existe no índice
+UPLOAD_DEDUP = os.environ.get("UPLOAD_DEDUP", "1") == "1"
+
+# Limpeza de órfãos: pastas verificadas em paralelo e tamanho dos lotes de delete
+CLEANUP_WORKERS = int(os.environ.get("CLEANUP_WORKERS", "16"))
+CLEANUP_BATCH = int(os.environ.get("CLEANUP_BATCH", "1000"))
+
 # Dicionário global para armazenar progresso de indexação
 indexing_progress = {}
 
@@ -82,14 +111,52 @@ env = Environment(
 es = Elasticsearch(ES_URL)
 
 
-# ------------- Helpers -------------
-def strip_accents(text: str) -> str:
-    if not text:
-        return ""
-    normalized = unicodedata.normalize("NFKD", text)
-    return "".join(c for c in normalized if not unicodedata.combining(c))
+@app.on_event("startup")
+def start_ingest_worker():
+    # Carrega o ingest em background: a 1ª indexação já não paga os imports
+    ingest_worker.start()
+    page_texts_nested(max_age=0)
+
+
+@app.middleware("http")
+async def measure_request_latency(request: Request, call_next):
+    """Histograma de latência por rota (template da rota, não o URL concreto)."""
+    t0 = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.observe(
+        "docsearch_http_request_duration_ms",
+        (time.perf_counter() - t0) * 1000,
+        route=getattr(route, "path", "unmatched"),
+        method=request.method,
+        status=response.status_code,
+    )
+    return response
 
 
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """
+    Recusa uploads acima de MAX_UPLOAD_REQUEST_MB pelo Content-Length, antes
+    de ler o corpo: o parser multipart grava o pedido inteiro em ficheiros
+    temporários antes de a rota /upload correr.
+    """
+    if request.method == "POST" and request.url.path == "/upload":
+        length = request.headers.get("content-length", "")
+        status, msg = None, None
+        if not length.isdigit():
+            status, msg = 411, "❌ Upload recusado: pedido sem Content-Length."
+        elif int(length) > MAX_UPLOAD_REQUEST_MB * 1024 * 1024:
+            status = 413
+            msg = f"❌ Upload recusado: excede o limite de {MAX_UPLOAD_REQUEST_MB} MB por pedido."
+        if status:
+            # home() pesquisa no ES e percorre a pasta: fora do event loop
+            page = await asyncio.to_thread(home, msg=msg)
+            return HTMLResponse(page, status_code=status)
+    return await call_next(request)
+
+
+# ------------- Helpers -------------
 def _to_float_or_none(s: str):
     if s is None:
         return None
@@ -119,6 +186,95 @@ def _detect_query_type(universal_query: str):
     return {"type": "text", "value": query}
 
 
+def build_bool_query(must: list, should: list, filters: list) -> dict:
+    """
+    Junta as cláusulas da pesquisa numa bool query.
+    - must/should: cláusulas que contam para o score
+    - filters: restrições sem score (pasta, IBAN, datas, valores), que o ES
+      guarda na filter cache e reaproveita entre pesquisas repetidas
+    """
+    if not (must or should or filters):
+        return {"match_all": {}}
+
+    bool_query = {}
+    if must:
+        bool_query["must"] = must
+    if should:
+        bool_query["should"] = should
+        bool_query["minimum_should_match"] = 1
+    if filters:
+        bool_query["filter"] = filters
+    return {"bool": bool_query}
+
+
+_page_texts_checked = (0.0, True)  # (instante, page_texts é nested)
+
+
+def page_texts_nested(max_age: float = 60.0) -> bool:
+    """
+    False se algum índice tem `page_texts` com outro tipo que não nested
+    (índice criado antes deste campo e depois completado por mapping
+    dinâmico): a cláusula nested daria HTTP 400 em todas as pesquisas.
+    """
+    global _page_texts_checked
+    checked_at, nested = _page_texts_checked
+    if time.time() - checked_at < max_age:
+        return nested
+    try:
+        mappings = es.indices.get_mapping(index=INDEX)
+        nested = True
+        for name, body in mappings.items():
+            field = ((body.get("mappings") or {}).get("properties") or {}).get("page_texts")
+            if field and field.get("type") != "nested":
+                nested = False
+                print(f"[WARN] '{name}': page_texts não é nested; a pesquisa por página fica "
+                      f"desligada até o índice ser reposto (Definições → Reset) e reindexado.")
+    except Exception:
+        nested = True  # índice ainda não existe: será criado com o mapping certo
+    _page_texts_checked = (time.time(), nested)
+    return nested
+
+
+def _page_hit_clause(text: str, phrase: bool = False) -> dict:
+    """
+    Cláusula nested sobre page_texts que devolve (inner_hits) a página com
+    melhor correspondência e o respetivo excerto destacado.
+    """
+    match_type = "match_phrase" if phrase else "match"
+    return {
+        "nested": {
+            "path": "page_texts",
+            "query": {match_type: {"page_texts.text": {"query": text}}},
+            "score_mode": "max",
+            "boost": 0.5,
+            "ignore_unmapped": True,
+            "inner_hits": {
+                "size": 1,
+                "_source": False,
+                "docvalue_fields": ["page_texts.page"],
+                "highlight": {
+                    "fields": {
+                        "page_texts.text": {"fragment_size": 200, "number_of_fragments": 1}
+                    }
+                },
+            },
+        }
+    }
+
+
+def _apply_page_hit(hit: dict):
+    """Copia a página (e o excerto da página, se faltar) do inner_hit para o hit."""
+    inner = (((hit.get("inner_hits") or {}).get("page_texts") or {}).get("hits") or {}).get("hits") or []
+    if not inner:
+        return
+    best = inner[0]
+    pages = (best.get("fields") or {}).get("page_texts.page") or []
+    hit["page"] = pages[0] if pages else None
+    fragments = (best.get("highlight") or {}).get("page_texts.text")
+    if fragments and not (hit.get("highlight") or {}).get("texto"):
+        hit.setdefault("highlight", {})["texto"] = fragments
+
+
 def get_default_folder() -> str:
     """Devolve a pasta por defeito atual (global)."""
     return DEFAULT_FOLDER
@@ -165,7 +321,7 @@ def count_indexed_docs(folder: str = None) -> int:
     try:
         if folder:
             base = normalize_folder(folder)
-            query = {"prefix": {"path.keyword": base}}
+            query = {"bool": {"filter": [{"prefix": {"path.keyword": base}}]}}
         else:
             query = {"match_all": {}}
         res = es.count(index=INDEX, body={"query": query})
@@ -231,23 +387,27 @@ def home(
     folder: str = "",
     exact: int = 0,
 ):
+    t_start = time.perf_counter()
     min_total_val = _to_float_or_none(min_total)
     max_total_val = _to_float_or_none(max_total)
+    query_type = "browse"
 
     # Normalizar pasta atual vinda do formulário/query
     current_folder = normalize_folder(folder)
 
+    # must/should pontuam; filter são restrições sem score (ficam na filter cache do ES)
     must = []
     should = []
+    filters = []
 
     # Filtrar sempre pela pasta atual
-    must.append({"prefix": {"path.keyword": current_folder}})
-
-    universal_ascii = strip_accents(universal.lower()) if universal else None
+    filters.append({"prefix": {"path.keyword": current_folder}})
 
     if universal:
         if force_text:
-            # Pesquisa forçada no texto + n-grams
+            query_type = "force_text"
+            # Pesquisa forçada no texto + n-grams (único caminho com fuzziness,
+            # para tolerar erros de OCR/escrita quando o utilizador o pede)
             should.append(
                 {
                     "multi_match": {
@@ -271,6 +431,7 @@ def home(
             )
         else:
             detection = _detect_query_type(universal)
+            query_type = detection["type"]
             if detection["type"] == "nif":
                 should.extend(
                     [
@@ -279,9 +440,9 @@ def home(
                     ]
                 )
             elif detection["type"] == "iban":
-                must.append({"term": {"entities.iban": detection["value"]}})
+                filters.append({"term": {"entities.iban": detection["value"]}})
             elif detection["type"] == "total":
-                must.append(
+                filters.append(
                     {
                         "range": {
                             "entities.total": {
@@ -292,19 +453,33 @@ def home(
                     }
                 )
             elif detection["type"] == "invoice":
+                invoice_norm = normalize_invoice_no(detection["value"])
                 should.extend(
                     [
+                        # Match exato no campo normalizado (term, tempo constante)
                         {
-                            "match": {
-                                "entities.invoice_no": {
-                                    "query": detection["value"],
-                                    "boost": 2,
+                            "term": {
+                                "entities.invoice_no_norm": {
+                                    "value": invoice_norm,
+                                    "boost": 4,
                                 }
                             }
                         },
+                        # Parcial (ex.: série omitida) no subcampo do tipo wildcard,
+                        # indexado em n-grams: não percorre todos os termos
                         {
                             "wildcard": {
-                                "entities.invoice_no": f"*{detection['value']}*"
+                                "entities.invoice_no_norm.wc": {
+                                    "value": f"*{invoice_norm}*",
+                                }
+                            }
+                        },
+                        {
+                            "match": {
+                                "entities.invoice_no": {
+                                    "query": detection["value"],
+                                    "boost": 2,
+                                }
                             }
                         },
                     ]
@@ -349,7 +524,8 @@ def home(
                         ]
                     )
                 else:
-                    # 🔍 Modo “Google”: fuzzy + n-grams
+                    # 🔍 Modo “Google”: analyzer pt_folded (acentos/plurais) + n-grams,
+                    # sem fuzziness (que obriga a expandir termos em todo o índice)
                     should.extend(
                         [
                             {
@@ -357,7 +533,6 @@ def home(
                                     "entities.supplier": {
                                         "query": universal,
                                         "boost": 3,
-                                        "fuzziness": "AUTO",
                                     }
                                 }
                             },
@@ -366,7 +541,6 @@ def home(
                                     "entities.client": {
                                         "query": universal,
                                         "boost": 3,
-                                        "fuzziness": "AUTO",
                                     }
                                 }
                             },
@@ -375,7 +549,6 @@ def home(
                                     "texto": {
                                         "query": universal,
                                         "boost": 1,
-                                        "fuzziness": "AUTO",
                                     }
                                 }
                             },
@@ -476,7 +649,6 @@ def home(
                                     "entities.supplier": {
                                         "query": universal,
                                         "boost": 2.5,
-                                        "fuzziness": "AUTO",
                                     }
                                 }
                             },
@@ -485,7 +657,6 @@ def home(
                                     "entities.client": {
                                         "query": universal,
                                         "boost": 2.5,
-                                        "fuzziness": "AUTO",
                                     }
                                 }
                             },
@@ -494,34 +665,34 @@ def home(
 
 
     elif q or nif or date_from or date_to or min_total or max_total:
+        query_type = "advanced"
         if q:
             must.append(
                 {"multi_match": {"query": q, "fields": ["filename^3", "texto"]}}
             )
         if nif:
-            must.append({"term": {"entities.nif": nif}})
+            filters.append({"term": {"entities.nif": nif}})
         if date_from or date_to:
             r = {}
             if date_from:
                 r["gte"] = date_from
             if date_to:
                 r["lte"] = date_to
-            must.append({"range": {"entities.date": r}})
+            filters.append({"range": {"entities.date": r}})
         if (min_total_val is not None) or (max_total_val is not None):
             r = {}
             if min_total_val is not None:
                 r["gte"] = min_total_val
             if max_total_val is not None:
                 r["lte"] = max_total_val
-            must.append({"range": {"entities.total": r}})
+            filters.append({"range": {"entities.total": r}})
 
-    if should:
-        query = {"bool": {"must": must, "should": should, "minimum_should_match": 1}}
-    else:
-        if must:
-            query = {"bool": {"must": must}}
-        else:
-            query = {"match_all": {}}
+    # Pesquisas de texto: localizar também a página com o resultado
+    if (universal and query_type in ("force_text", "name", "text") and PAGE_TEXT_SEARCH
+            and page_texts_nested()):
+        should.append(_page_hit_clause(universal, phrase=bool(exact) and query_type != "force_text"))
+
+    query = build_bool_query(must, should, filters)
 
     body = {
         "query": query,
@@ -532,6 +703,9 @@ def home(
             "language",
             "indexed_at",
             "texto",
+            "checksum",
+            "pages",
+            "ocr_engine",
         ],
         "highlight": {
             "fields": {"texto": {"fragment_size": 200, "number_of_fragments": 1}}
@@ -542,13 +716,25 @@ def home(
         ],
     }
 
+    took_ms = None
     try:
-        res = es.search(index=INDEX, size=size, body=body)
+        # Com partições por ano, um filtro de datas (pesquisa avançada) só
+        # consulta os anos que cobre
+        search_index = INDEX
+        if query_type == "advanced":
+            search_index = index_partitions.indices_for_range(es, INDEX, date_from, date_to)
+        res = es.search(index=search_index, size=size, body=body,
+                        ignore_unavailable=True, allow_no_indices=True)
         hits = res["hits"]["hits"]
+        took_ms = res.get("took")
+        for hit in hits:
+            _apply_page_hit(hit)
     except Exception as e:
         hits = []
         msg = f"Erro na pesquisa: {str(e)}"
 
+    metrics.record_search(query_type, (time.perf_counter() - t_start) * 1000, took_ms, body)
+
     # Obter lista de pastas disponíveis com base na pasta atual
     available_folders = get_subfolders(current_folder)
 
@@ -569,11 +755,75 @@ def home(
     )
 
 
+# ------------- Sugestões (autocomplete) -------------
+@app.get("/api/suggest")
+def api_suggest(q: str = "", size: int = 8):
+    """Sugestões de fornecedores/clientes/ficheiros a partir do campo completion."""
+    prefix = q.strip()
+    if len(prefix) < 2:
+        return JSONResponse({"suggestions": []})
+
+    body = {
+        "_source": False,
+        "suggest": {
+            "names": {
+                "prefix": prefix,
+                "completion": {
+                    "field": "suggest",
+                    "size": max(1, min(size, 20)),
+                    "skip_duplicates": True,
+                },
+            }
+        },
+    }
+    try:
+        res = es.search(index=INDEX, body=body)
+        options = res["suggest"]["names"][0]["options"]
+    except Exception:
+        options = []
+
+    return JSONResponse({"suggestions": [opt["text"] for opt in options]})
+
+
+# ------------- Métricas -------------
+def _es_cache_gauges() -> dict:
+    """Hits/misses das caches de query e de request do ES para o índice."""
+    gauges = {}
+    try:
+        stats = es.indices.stats(index=INDEX, metric=["query_cache", "request_cache"])
+        total = stats["_all"]["total"]
+        for cache in ("query_cache", "request_cache"):
+            c = total.get(cache, {})
+            hits = c.get("hit_count", 0)
+            misses = c.get("miss_count", 0)
+            gauges.setdefault("docsearch_es_cache_hits", []).append(({"cache": cache}, hits))
+            gauges.setdefault("docsearch_es_cache_misses", []).append(({"cache": cache}, misses))
+            ratio = hits / (hits + misses) if (hits + misses) else 0
+            gauges.setdefault("docsearch_es_cache_hit_ratio", []).append(({"cache": cache}, round(ratio, 4)))
+    except Exception as e:
+        print(f"[WARN] Falha ao obter estatísticas de cache do ES: {e}")
+    return gauges
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Métricas em formato Prometheus."""
+    return PlainTextResponse(
+        metrics.render_prometheus(_es_cache_gauges()),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@app.get("/api/slow_queries")
+def api_slow_queries():
+    """Slow-query log: pesquisas acima de SLOW_QUERY_MS com o body do ES."""
+    return JSONResponse({"threshold_ms": metrics.SLOW_QUERY_MS, "queries": metrics.slow_queries()})
+
+
 # ------------- API de progresso -------------
 @app.get("/api/progress/")
 def get_progress_empty():
     """Trata pedidos sem task_id (evita 404 no log)"""
-    print("[API] /api/progress/ chamado sem task_id")
     return JSONResponse({
         "status": "not_found",
         "progress": 0,
@@ -587,10 +837,7 @@ def get_progress_empty():
 @app.get("/api/progress/{task_id}")
 def get_progress(task_id: str):
     """Retorna o progresso da indexação"""
-    print(f"[API] Getting progress for task_id: {task_id}")
-
     if not task_id:
-        print("[API] ERROR: Empty task_id")
         return JSONResponse({
             "status": "error",
             "progress": 0,
@@ -601,13 +848,8 @@ def get_progress(task_id: str):
 
     if task_id in indexing_progress:
         raw = indexing_progress[task_id]
-        # Criar cópia para não expor objetos não‑serializáveis (ex.: subprocess.Popen)
-        data = dict(raw)
-        data.pop("process", None)
-        print(f"[API] Progress for {task_id}: {data.get('current', 0)}/{data.get('total', 0)}")
-        return JSONResponse(data)
+        return JSONResponse(dict(raw))
 
-    print(f"[API] Task {task_id} not found")
     return JSONResponse({
         "status": "not_found",
         "progress": 0,
@@ -630,14 +872,9 @@ def cancel_indexing(task_id: str):
     data["message"] = "❌ Indexação cancelada pelo utilizador."
     indexing_progress[task_id] = data
 
-    # Encerrar processo, se existir
-    try:
-        proc = data.get("process")
-        if proc is not None and proc.poll() is None:
-            proc.terminate()
-            print(f"[API] Processo de indexação {task_id} terminado.")
-    except Exception as e:
-        print(f"[API] Erro ao terminar processo {task_id}: {e}")
+    # Parar o trabalho no worker (termina o ficheiro em curso)
+    if ingest_worker.cancel(task_id):
+        print(f"[API] Trabalho de indexação {task_id} cancelado.")
 
     return JSONResponse({"status": "cancelled", "message": "Indexação cancelada com sucesso."})
 
@@ -647,111 +884,118 @@ def api_cancel(task_id: str):
     """Endpoint HTTP para cancelar a indexação atual."""
     return cancel_indexing(task_id)
 
-# ------------- Reindex com progresso -------------
-def run_indexing_with_progress(task_id: str, target_dir: str, only_new: bool):
-    """Executa indexação e atualiza progresso"""
-    print(f"[THREAD] Starting indexing for task {task_id}")
-    print(f"[THREAD] Directory: {target_dir}")
-    print(f"[THREAD] Only new: {only_new}")
-    
+
+# ------------- Workers remotos (python ingest.py --worker <url>) -------------
+# Sem INGEST_WORKER_TOKEN as leases ficam desligadas (404)
+INGEST_WORKER_TOKEN = os.environ.get("INGEST_WORKER_TOKEN", "")
+
+
+def _worker_authorized(request: Request) -> bool:
+    token = request.headers.get("X-Ingest-Token", "")
+    return bool(INGEST_WORKER_TOKEN) and hmac.compare_digest(token, INGEST_WORKER_TOKEN)
+
+
+@app.post("/api/ingest/lease")
+async def api_ingest_lease(request: Request):
+    """Entrega o próximo ficheiro a extrair a um worker remoto (204 se não houver)."""
+    if not _worker_authorized(request):
+        return JSONResponse({"error": "not found"}, status_code=404)
     try:
-        # Contar ficheiros totais
-        total_files = count_local_docs(target_dir)
-        print(f"[THREAD] Total files to process: {total_files}")
-        
-        indexing_progress[task_id] = {
-            "status": "running",
-            "progress": 0,
-            "total": total_files,
-            "current": 0,
-            "folder": target_dir,
-            "process": None,
-            "message": ""
-        }
+        body = await request.json()
+    except Exception:
+        body = {}
+    worker = str(body.get("worker") or request.client.host)
+    lease = await asyncio.to_thread(ingest_worker.lease, worker)
+    if lease is None:
+        return Response(status_code=204)
+    return JSONResponse(lease)
+
+
+@app.get("/api/ingest/lease/{lease_id}/file")
+def api_ingest_lease_file(lease_id: str, request: Request):
+    """Conteúdo do ficheiro de uma lease ativa."""
+    if not _worker_authorized(request):
+        return JSONResponse({"error": "not found"}, status_code=404)
+    path = ingest_worker.lease_path(lease_id)
+    if not path or not os.path.isfile(path):
+        return JSONResponse({"error": "lease expirada"}, status_code=410)
+    return FileResponse(path, media_type="application/octet-stream")
+
+
+@app.post("/api/ingest/lease/{lease_id}/parts")
+async def api_ingest_lease_parts(lease_id: str, request: Request):
+    """Recebe um lote de continuações ({"parts": [bloco, ...]}) antes do resultado."""
+    if not _worker_authorized(request):
+        return JSONResponse({"error": "not found"}, status_code=404)
+    body = await request.json()
+    ok = await asyncio.to_thread(ingest_worker.add_lease_parts, lease_id, body.get("parts") or [])
+    if not ok:
+        return JSONResponse({"error": "lease expirada"}, status_code=410)
+    return JSONResponse({"status": "ok"})
+
+
+@app.post("/api/ingest/lease/{lease_id}/result")
+async def api_ingest_lease_result(lease_id: str, request: Request):
+    """Recebe o documento extraído ({"doc"} ou {"error"}) e indexa-o."""
+    if not _worker_authorized(request):
+        return JSONResponse({"error": "not found"}, status_code=404)
+    result = await request.json()
+    status = await asyncio.to_thread(ingest_worker.complete_lease, lease_id, result)
+    if status is None:
+        return JSONResponse({"error": "lease expirada"}, status_code=410)
+    return JSONResponse({"status": status})
 
-        ingest = os.path.join(BASE_DIR, "ingest.py")
-        cmd = [sys.executable, ingest, target_dir]
-        if only_new:
-            cmd.append("new_only")
-        
-        print(f"[THREAD] Running command: {' '.join(cmd)}")
-
-        # Executar processo
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            encoding="utf-8",
-            errors="replace",
-            bufsize=1
-        )
+# ------------- Reindex com progresso -------------
+def run_indexing_with_progress(task_id: str, target_dir: str, only_new: bool, files: list | None = None,
+                               priority: int | None = None):
+    """
+    Põe a indexação na fila do worker residente (ingest_worker) e vai
+    atualizando o progresso da tarefa. Não bloqueia.
+    Com `files`, indexa só esses ficheiros (ex.: uploads) em vez de percorrer a pasta.
+    `priority`: ingest_worker.PRIORITY_* (por defeito, alta para `files` e baixa para pastas).
+    """
+    total_files = len(files) if files is not None else count_local_docs(target_dir)
+    print(f"[WORKER] Task {task_id}: {total_files} ficheiro(s) em {target_dir} (only_new={only_new})")
 
-        # Guardar processo para permitir cancelamento
-        indexing_progress[task_id]["process"] = process
+    indexing_progress[task_id] = {
+        "status": "starting",
+        "progress": 0,
+        "total": total_files,
+        "current": 0,
+        "folder": target_dir,
+        "message": "",
+    }
 
-        # Monitorizar output
-        indexed_count = 0
-        output_lines = []
-        
-        while True:
-            line = process.stdout.readline()
-            if not line and process.poll() is not None:
-                break
-            
-            if line:
-                output_lines.append(line.strip())
-                # Contar ficheiros indexados
-                if "INDEXED:" in line or "SKIP" in line:
-                    indexed_count += 1
-                    progress_pct = int((indexed_count / total_files * 100)) if total_files > 0 else 0
-                    indexing_progress[task_id].update({
-                        "progress": progress_pct,
-                        "current": indexed_count,
-                        "status": "running"
-                    })
-                    print(f"[THREAD] Progress: {indexed_count}/{total_files} ({progress_pct}%)")
-
-        # Capturar erros
-        stderr_output = process.stderr.read()
-        
-        # Finalizar
-        return_code = process.wait()
-        print(f"[THREAD] Process completed with return code: {return_code}")
-
-        current_data = indexing_progress.get(task_id, {})
-        if current_data.get("status") == "cancelled":
-            final_status = "cancelled"
-        else:
-            final_status = "completed" if return_code == 0 else "error"
-
-        indexing_progress[task_id].update({
-            "status": final_status,
-            "progress": 100 if final_status == "completed" else indexing_progress[task_id].get("progress", 0),
-            "return_code": return_code,
-            "output": "\n".join(output_lines[-30:]),
-            "errors": stderr_output[-1000:] if stderr_output else ""
-        })
+    def on_file(job, path, status):
+        if _task_cancelled(task_id):
+            return
+        progress_pct = int(job.done / total_files * 100) if total_files > 0 else 0
+        _update_task(
+            task_id,
+            status="running",
+            progress=min(progress_pct, 100),
+            current=job.done,
+            output="\n".join(job.log),
+        )
 
-        print(f"[THREAD] Task {task_id} finished")
+    def on_done(job):
+        final_status = "cancelled" if _task_cancelled(task_id) else job.status
+        _update_task(
+            task_id,
+            status=final_status,
+            progress=100 if final_status == "completed" else indexing_progress[task_id].get("progress", 0),
+            current=job.done,
+            output="\n".join(job.log),
+            errors=job.error or "",
+        )
+        print(f"[WORKER] Task {task_id} terminou: {final_status} ({job.done} ficheiro(s))")
 
-    except Exception as e:
-        print(f"[THREAD] ERROR in task {task_id}: {e}")
-        indexing_progress[task_id] = {
-            "status": "error",
-            "progress": 0,
-            "total": 0,
-            "current": 0,
-            "error": str(e)
-        }
+    ingest_worker.submit(task_id, folder=target_dir, files=files, only_new=only_new,
+                         on_file=on_file, on_done=on_done, priority=priority)
 
 
 @app.api_route("/reindex", methods=["GET", "POST"], response_class=HTMLResponse)
 async def reindex(request: Request = None):
-    print("\n" + "="*60)
-    print("DEBUG: reindex() foi chamado!")
-    print("="*60)
-
     folder = ""
     only_new = False
 
@@ -768,34 +1012,17 @@ async def reindex(request: Request = None):
 
     # Manter caminho exatamente como vem do formulário, só normalizar para absoluto
     target_dir = os.path.abspath(folder or get_default_folder())
-    print(f"DEBUG: target_dir = {target_dir!r}")
 
     if not os.path.isdir(target_dir):
         msg = f"Pasta inválida: {target_dir}"
-        print(f"DEBUG: Pasta inválida! Retornando home()")
         return home(msg=msg, folder=target_dir)
 
     # Criar ID único para esta tarefa
     task_id = str(uuid.uuid4())
     print(f"[REINDEX] Created task_id: {task_id} for folder: {target_dir}")
 
-    # Inicializar progresso imediatamente
-    total_files = count_local_docs(target_dir)
-    indexing_progress[task_id] = {
-        "status": "starting",
-        "progress": 0,
-        "total": total_files,
-        "current": 0,
-        "folder": target_dir
-    }
-
-    # Iniciar indexação em thread separada
-    thread = threading.Thread(
-        target=run_indexing_with_progress,
-        args=(task_id, target_dir, only_new),
-        daemon=True
-    )
-    thread.start()
+    # Indexação no worker residente (em background)
+    run_indexing_with_progress(task_id, target_dir, only_new, priority=ingest_worker.PRIORITY_LOW)
 
     # Retornar página com polling de progresso
     template = env.get_template("progress.html")
@@ -808,43 +1035,142 @@ async def reindex(request: Request = None):
 
 # ------------- Função comum para limpar índice -------------
 def delete_es_index() -> str:
+    global _page_texts_checked
+    _page_texts_checked = (0.0, True)  # o índice novo volta a ser verificado
     try:
-        if es.indices.exists(index=INDEX):
-            es.indices.delete(index=INDEX)
+        # Com partições por ano, INDEX é um alias: apagar as partições
+        if index_partitions.delete_all(es, INDEX):
             return f"🧹 Índice '{INDEX}' apagado com sucesso!"
         else:
             return f"⚠️ O índice '{INDEX}' não existe ou já foi apagado."
     except Exception as e:
         return f"Erro ao apagar índice '{INDEX}': {e}"
 
-def cleanup_orphan_docs() -> tuple[int, int, str]:
+def _update_task(task_id: str | None, **fields):
+    """Atualiza o progresso de uma tarefa em background (se houver task_id)."""
+    if task_id and task_id in indexing_progress:
+        indexing_progress[task_id].update(fields)
+
+
+def _task_cancelled(task_id: str | None) -> bool:
+    return bool(task_id) and indexing_progress.get(task_id, {}).get("status") == "cancelled"
+
+
+def _list_dir_names(directory: str):
+    """
+    Nomes dos ficheiros numa pasta (um único scandir).
+    Devolve None se a pasta não puder ser lida por outro motivo que não
+    "não existe" (ex.: share de rede indisponível) -> não se apaga nada dela.
+    """
+    try:
+        with os.scandir(directory) as it:
+            return {entry.name for entry in it}
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
+    except OSError as e:
+        print(f"[CLEANUP] Não foi possível ler {directory}: {e}")
+        return None
+
+
+def cleanup_orphan_docs(task_id: str | None = None) -> tuple[int, int, str]:
     """
     Remove do índice todos os documentos cujo ficheiro em disco já não existe.
+    1) scan do índice (só _id + path), agrupado por pasta
+    2) um scandir por pasta, em paralelo (CLEANUP_WORKERS)
+    3) deletes em bulk, em lotes de CLEANUP_BATCH
+    Se tiver task_id, vai atualizando indexing_progress[task_id].
     Devolve: (total_no_índice, removidos, erro)
     """
     total_docs = 0
     removed = 0
 
     try:
-        # Usar scan para percorrer todo o índice sem rebentar memória
+        try:
+            expected = int(es.count(index=INDEX)["count"])
+        except Exception:
+            expected = 0
+        _update_task(task_id, total=expected, message="A ler documentos do índice...")
+
+        # 1) Agrupar documentos por pasta
+        orphans = []
+        by_dir = {}
         for doc in scan(es, index=INDEX, query={"query": {"match_all": {}}}, _source=["path"]):
             total_docs += 1
-            src = doc.get("_source", {}) or {}
-            path = src.get("path")
-
-            # Se não tiver path ou o ficheiro não existir, marcar para remoção
-            if not path or not os.path.exists(path):
-                try:
-                    es.delete(index=INDEX, id=doc["_id"])
-                    removed += 1
-                except Exception as e:
-                    print(f"[CLEANUP] Erro ao apagar doc {doc['_id']}: {e}")
-
+            path = (doc.get("_source") or {}).get("path")
+            # (índice, id): com partições por ano cada documento está na sua partição
+            doc_key = (doc["_index"], doc["_id"])
+            if not path:
+                orphans.append(doc_key)
+            else:
+                by_dir.setdefault(os.path.dirname(path), []).append(
+                    (doc_key, os.path.basename(path))
+                )
+            if total_docs % 5000 == 0:
+                if _task_cancelled(task_id):
+                    return total_docs, removed, ""
+                _update_task(task_id, current=total_docs,
+                             progress=int(total_docs / expected * 30) if expected else 0)
+
+        # 2) Um scandir por pasta, em paralelo
+        _update_task(task_id, total=total_docs, current=0, progress=30,
+                     message=f"A verificar {len(by_dir)} pasta(s)...")
+        checked = 0
+        with ThreadPoolExecutor(max_workers=CLEANUP_WORKERS) as pool:
+            for directory, names in zip(by_dir, pool.map(_list_dir_names, by_dir)):
+                docs = by_dir[directory]
+                checked += len(docs)
+                if names is not None:
+                    orphans.extend(doc_key for doc_key, name in docs if name not in names)
+                if _task_cancelled(task_id):
+                    return total_docs, removed, ""
+                _update_task(task_id, current=checked,
+                             progress=30 + int(checked / total_docs * 40) if total_docs else 70)
+
+        # 3) Deletes em bulk
+        _update_task(task_id, total=len(orphans), current=0, progress=70,
+                     message=f"A remover {len(orphans)} documento(s) órfão(s)...")
+        for start in range(0, len(orphans), CLEANUP_BATCH):
+            if _task_cancelled(task_id):
+                break
+            batch = orphans[start:start + CLEANUP_BATCH]
+            ok, errors = bulk(
+                es,
+                ({"_op_type": "delete", "_index": index_name, "_id": doc_id}
+                 for index_name, doc_id in batch),
+                raise_on_error=False,
+                refresh=False,
+            )
+            removed += ok
+            for err in errors[:5]:
+                print(f"[CLEANUP] Erro ao apagar doc: {err}")
+            done = start + len(batch)
+            _update_task(task_id, current=done, progress=70 + int(done / len(orphans) * 30))
+
+        if removed:
+            es.indices.refresh(index=INDEX)
         return total_docs, removed, ""
     except Exception as e:
         return total_docs, removed, str(e)
 
 
+def run_cleanup_with_progress(task_id: str):
+    """Executa a limpeza de órfãos em background e guarda o resultado na tarefa."""
+    total, removed, error = cleanup_orphan_docs(task_id)
+
+    if _task_cancelled(task_id):
+        _update_task(task_id, message=f"❌ Limpeza cancelada ({removed} documento(s) já removido(s)).")
+    elif error:
+        _update_task(task_id, status="error", error=f"Erro ao limpar documentos órfãos do índice: {error}")
+    else:
+        if removed == 0:
+            msg = "ℹ️ Não foram encontrados documentos órfãos. O índice já está limpo."
+        else:
+            msg = f"✅ Limpeza concluída: {removed} documento(s) removido(s) de {total} registados no índice."
+        _update_task(task_id, status="completed", progress=100, message=msg, output=msg)
+
+    print(f"[CLEANUP] Task {task_id}: {removed}/{total} removido(s) {error or ''}")
+
+
 
 # ------------- Limpar índice (da página principal) -------------
 @app.post("/delete_index", response_class=HTMLResponse)
@@ -865,54 +1191,215 @@ async def delete_index(request: Request):
 async def settings_cleanup_index(request: Request):
     """
     Limpa do índice todos os documentos cujo ficheiro em disco já não existe.
-    Acionado pelo botão cinzento nas definições.
+    Acionado pelo botão cinzento nas definições; corre em background com
+    a mesma página de progresso da indexação.
     """
-    total, removed, error = cleanup_orphan_docs()
+    task_id = str(uuid.uuid4())
+    indexing_progress[task_id] = {
+        "status": "running",
+        "progress": 0,
+        "total": 0,
+        "current": 0,
+        "folder": get_default_folder(),
+        "message": "A preparar limpeza...",
+    }
 
-    if error:
-        msg = f"❌ Erro ao limpar documentos órfãos do índice: {error}"
-    else:
-        if removed == 0:
-            msg = "ℹ️ Não foram encontrados documentos órfãos. O índice já está limpo."
-        else:
-            msg = f"✅ Limpeza concluída: {removed} documento(s) removido(s) de {total} registados no índice."
+    thread = threading.Thread(target=run_cleanup_with_progress, args=(task_id,), daemon=True)
+    thread.start()
 
-    return settings(msg=msg)
+    template = env.get_template("progress.html")
+    return template.render(
+        task_id=task_id,
+        folder=get_default_folder(),
+        title="🧩 Limpeza de documentos órfãos",
+        mode_label="Remover do índice ficheiros que já não existem em disco",
+    )
 
 # ------------- Upload (caso ainda venhas a usar esta rota) -------------
+async def save_upload_stream(f: UploadFile, dest: str, max_bytes: int) -> tuple[int, str]:
+    """
+    Grava o upload em disco aos blocos (UPLOAD_CHUNK), calculando o SHA-256
+    em simultâneo. Escreve para `dest + ".part"` e só renomeia no fim.
+    Devolve (bytes, sha256). Lança ValueError se passar `max_bytes`.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    tmp = dest + ".part"
+    try:
+        with open(tmp, "wb") as out:
+            while True:
+                chunk = await f.read(UPLOAD_CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError("excede o limite")
+                digest.update(chunk)
+                out.write(chunk)
+        os.replace(tmp, dest)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    finally:
+        await f.close()
+    return size, digest.hexdigest()
+
+
+def find_indexed_checksums(checksums: list) -> dict:
+    """{checksum: path} dos documentos já indexados com esse conteúdo."""
+    found = {}
+    if not checksums:
+        return found
+    try:
+        res = es.search(
+            index=INDEX,
+            size=len(checksums) * 10,
+            query={"bool": {"filter": [{"terms": {"checksum": checksums}}]}},
+            _source=["path", "checksum"],
+        )
+        for hit in res["hits"]["hits"]:
+            src = hit.get("_source") or {}
+            if src.get("path") and os.path.exists(src["path"]):
+                found[src["checksum"]] = src["path"]
+    except Exception as e:
+        print(f"[WARN] Falha ao verificar duplicados no índice: {e}")
+    return found
+
+
 @app.post("/upload", response_class=HTMLResponse)
-async def upload(files: list[UploadFile] = File(...), folder: str = ""):
+async def upload(request: Request, files: list[UploadFile] = File(...), folder: str = ""):
     target_folder = normalize_folder(folder)
     os.makedirs(target_folder, exist_ok=True)
-    
+
+    # O Content-Length já foi verificado em limit_upload_size, antes de ler o corpo
+    max_file = MAX_UPLOAD_FILE_MB * 1024 * 1024
+    max_request = MAX_UPLOAD_REQUEST_MB * 1024 * 1024
+
     saved = []
+    rejected = []
+    received = []  # (nome original, destino, sha256)
+    request_bytes = 0
     for f in files:
         base = os.path.basename(f.filename or "documento")
         name, ext = os.path.splitext(base)
         safe = f"{name[:80]}__{uuid.uuid4().hex[:8]}{ext or ''}"
         dest = os.path.join(target_folder, safe)
-        with open(dest, "wb") as out:
-            out.write(await f.read())
-        saved.append(safe)
-
-    # Criar task ID para indexação
-    task_id = str(uuid.uuid4())
-    
-    # Indexar em background
-    thread = threading.Thread(
-        target=run_indexing_with_progress,
-        args=(task_id, target_folder, True),  # only_new=True
-        daemon=True
-    )
-    thread.start()
-
-    msg = f"✅ {len(saved)} ficheiro(s) carregado(s). Indexação em progresso..."
+        budget = min(max_file, max_request - request_bytes)
+        try:
+            size, sha256 = await save_upload_stream(f, dest, budget)
+        except ValueError:
+            if budget < max_file:
+                reason = f"excede o limite de {MAX_UPLOAD_REQUEST_MB} MB por pedido"
+            else:
+                reason = f"excede o limite de {MAX_UPLOAD_FILE_MB} MB por ficheiro"
+            rejected.append(f"{base} ({reason})")
+            continue
+        request_bytes += size
+        received.append((base, dest, sha256))
+
+    # Deduplicação por conteúdo: repetido no mesmo pedido ou já indexado
+    duplicates = []
+    indexed = find_indexed_checksums(sorted({h for _, _, h in received})) if UPLOAD_DEDUP else {}
+    seen = {}
+    for base, dest, sha256 in received:
+        existing = seen.get(sha256) or indexed.get(sha256)
+        if UPLOAD_DEDUP and existing:
+            os.remove(dest)
+            duplicates.append(f"{base} (igual a {os.path.basename(existing)})")
+            continue
+        seen[sha256] = dest
+        saved.append(dest)
+
+    msg_parts = []
+    if saved:
+        # Uma única tarefa de indexação, só com os ficheiros recebidos
+        task_id = str(uuid.uuid4())
+        run_indexing_with_progress(task_id, target_folder, False, saved,
+                                   priority=ingest_worker.PRIORITY_HIGH)
+        msg_parts.append(f"✅ {len(saved)} ficheiro(s) carregado(s). Indexação em progresso...")
+    if duplicates:
+        msg_parts.append(f"ℹ️ {len(duplicates)} duplicado(s) ignorado(s): " + "; ".join(duplicates))
+    if rejected:
+        msg_parts.append("❌ Recusado(s): " + "; ".join(rejected))
+
+    msg = " ".join(msg_parts) or "❌ Nenhum ficheiro recebido."
+    if duplicates:
+        print(f"[UPLOAD] Duplicados ignorados: {duplicates}")
     return home(msg=msg, folder=target_folder)
 
 
 # ------------- Ver ficheiro -------------
+VIEW_CHUNK = 256 * 1024
+
+
+def _file_etag(st: os.stat_result) -> str:
+    """ETag forte a partir de tamanho + mtime (muda sempre que o ficheiro muda)."""
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def _is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """If-None-Match tem prioridade; If-Modified-Since só se não houver ETag no pedido."""
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        tags = [t.strip() for t in inm.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(mtime) <= parsedate_to_datetime(ims).timestamp()
+        except Exception:
+            return False
+    return False
+
+
+def _parse_byte_range(header: str, size: int):
+    """
+    Interpreta 'Range: bytes=...' (um único intervalo).
+    Devolve (início, fim) inclusivo, None se deve ser ignorado (ex.: vários
+    intervalos) ou "invalid" se não for satisfazível.
+    """
+    m = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header or "")
+    if not m:
+        return None
+    first, last = m.groups()
+    if not first and not last:
+        return "invalid"
+    if not first:
+        # bytes=-N -> últimos N bytes
+        length = int(last)
+        if length == 0:
+            return "invalid"
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return "invalid"
+    return start, end
+
+
+def _iter_file_range(path: str, start: int, end: int):
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = fh.read(min(VIEW_CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
 @app.get("/view")
-def view_file(p: str):
+def view_file(request: Request, p: str):
+    """
+    Serve o ficheiro original com suporte a:
+    - ETag/Last-Modified + If-None-Match/If-Modified-Since (304)
+    - Range/If-Range (206), para o visualizador de PDF só pedir as páginas que mostra
+    """
     if not p:
         return Response("Parametro 'p' em falta.", status_code=400)
 
@@ -921,21 +1408,81 @@ def view_file(p: str):
     if not os.path.exists(abs_path):
         return Response("Ficheiro não encontrado.", status_code=404)
 
+    st = os.stat(abs_path)
+    size = st.st_size
     media_type, _ = mimetypes.guess_type(abs_path)
+    media_type = media_type or "application/octet-stream"
+
+    etag = _file_etag(st)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+    }
+    if media_type.startswith("image/") or media_type == "application/pdf":
+        headers["Content-Disposition"] = f"inline; filename*=UTF-8''{quote(os.path.basename(abs_path))}"
+    else:
+        headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(os.path.basename(abs_path))}"
+
+    if _is_not_modified(request, etag, st.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = _parse_byte_range(range_header, size)
+        if byte_range == "invalid":
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                _iter_file_range(abs_path, start, end),
+                status_code=206,
+                media_type=media_type,
+                headers=headers,
+            )
 
-    headers = {}
-    if media_type and (
-        media_type.startswith("image/") or media_type == "application/pdf"
-    ):
-        headers["Content-Disposition"] = (
-            f'inline; filename="{os.path.basename(abs_path)}"'
-        )
+    return FileResponse(abs_path, media_type=media_type, headers=headers, stat_result=st)
+
+
+# ------------- Miniaturas -------------
+@app.get("/preview")
+def preview_file(request: Request, p: str, page: int = 1, w: int = previews.DEFAULT_WIDTH, h: str = ""):
+    """
+    Miniatura da página `page` (WebP/PNG), gerada uma vez e servida da cache
+    em disco. `h` (checksum no índice) só serve para mudar o URL quando o
+    documento é reindexado; a chave da cache e o ETag vêm do stat do ficheiro.
+    """
+    abs_path = os.path.abspath(unquote(p or ""))
+    if not p or not os.path.isfile(abs_path):
+        return Response("Ficheiro não encontrado.", status_code=404)
+    if os.path.splitext(abs_path)[1].lower() not in previews.PREVIEW_EXTS:
+        return Response("Pré-visualização não disponível para este tipo de ficheiro.", status_code=415)
+
+    # Revalidar sempre: o ETag custa um stat e muda quando o ficheiro muda
+    cache_control = "no-cache"
+
+    width = previews.clamp_width(w)
+    key = previews.preview_key(abs_path, max(1, page), width)
+    etag = f'"{key}"'
+    if etag in request.headers.get("if-none-match", ""):
+        metrics.record_cache("preview", True)
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+    try:
+        cache_path, key, hit = previews.get_preview(abs_path, page, width)
+    except Exception as e:
+        print(f"[WARN] Falha ao gerar miniatura de {abs_path}: {e}")
+        return Response("Não foi possível gerar a pré-visualização.", status_code=500)
+    metrics.record_cache("preview", hit)
 
     return FileResponse(
-        abs_path,
-        media_type=media_type or "application/octet-stream",
-        headers=headers,
-        filename=os.path.basename(abs_path),
+        cache_path,
+        media_type=previews.media_type(),
+        headers={"ETag": f'"{key}"', "Cache-Control": cache_control},
     )
 
 
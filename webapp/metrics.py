@@ -0,0 +1,147 @@
+"""
+Métricas em memória da webapp, expostas em formato de texto Prometheus.
+
+- Histogramas de latência (ms) por rota e por tipo de pesquisa
+- Contadores genéricos (ex.: hits/misses de caches)
+- Slow-query log: últimas pesquisas acima de SLOW_QUERY_MS, com o body do ES
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Limites dos buckets dos histogramas (ms)
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "500"))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get("SLOW_QUERY_LOG_SIZE", "50"))
+
+_lock = threading.Lock()
+# (nome, labels) -> {"buckets": [...], "sum": float, "count": int}
+_histograms = {}
+# (nome, labels) -> valor
+_counters = {}
+_slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+# Descrições (HELP) das métricas conhecidas
+_HELP = {
+    "docsearch_http_request_duration_ms": "Latência dos pedidos HTTP por rota (ms)",
+    "docsearch_search_total_ms": "Tempo total da pesquisa em home() por tipo de query (ms)",
+    "docsearch_search_es_took_ms": "Tempo reportado pelo Elasticsearch ('took') por tipo de query (ms)",
+    "docsearch_slow_queries_total": "Pesquisas acima do limite SLOW_QUERY_MS",
+    "docsearch_cache_requests_total": "Pedidos a caches por resultado (hit/miss)",
+}
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(name: str, value_ms: float, **labels):
+    """Regista uma observação (ms) no histograma `name` com as labels dadas."""
+    key = _key(name, labels)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = {"buckets": [0] * len(LATENCY_BUCKETS_MS), "sum": 0.0, "count": 0}
+            _histograms[key] = h
+        for i, limit in enumerate(LATENCY_BUCKETS_MS):
+            if value_ms <= limit:
+                h["buckets"][i] += 1
+        h["sum"] += value_ms
+        h["count"] += 1
+
+
+def inc(name: str, amount: float = 1, **labels):
+    """Incrementa o contador `name`."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def record_cache(cache: str, hit: bool):
+    """Atalho para contar hits/misses de uma cache da aplicação."""
+    inc("docsearch_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def record_search(query_type: str, total_ms: float, took_ms, body: dict):
+    """
+    Regista uma pesquisa: tempo total vs 'took' do ES e, se passar o limite,
+    guarda o body gerado no slow-query log.
+    """
+    observe("docsearch_search_total_ms", total_ms, query_type=query_type)
+    if took_ms is not None:
+        observe("docsearch_search_es_took_ms", took_ms, query_type=query_type)
+
+    if total_ms >= SLOW_QUERY_MS:
+        inc("docsearch_slow_queries_total", query_type=query_type)
+        entry = {
+            "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "query_type": query_type,
+            "total_ms": round(total_ms, 1),
+            "es_took_ms": took_ms,
+            "body": body,
+        }
+        with _lock:
+            _slow_queries.append(entry)
+        print(
+            f"[SLOW] {query_type} {total_ms:.0f} ms (ES took {took_ms} ms): "
+            f"{json.dumps(body, ensure_ascii=False)[:2000]}"
+        )
+
+
+def slow_queries() -> list:
+    """Cópia do slow-query log (mais recentes primeiro)."""
+    with _lock:
+        return list(reversed(_slow_queries))
+
+
+def _fmt_labels(labels: tuple, extra: dict | None = None) -> str:
+    items = list(labels) + list((extra or {}).items())
+    if not items:
+        return ""
+    inner = ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in items)
+    return "{" + inner + "}"
+
+
+def render_prometheus(extra_gauges: dict | None = None) -> str:
+    """
+    Exporta todas as métricas em formato de texto Prometheus.
+    `extra_gauges`: {nome: [(labels_dict, valor), ...]} calculados no momento
+    (ex.: estatísticas de cache do Elasticsearch).
+    """
+    lines = []
+    seen = set()
+
+    def header(name: str, kind: str):
+        if name in seen:
+            return
+        seen.add(name)
+        if name in _HELP:
+            lines.append(f"# HELP {name} {_HELP[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    with _lock:
+        histograms = {k: {"buckets": list(v["buckets"]), "sum": v["sum"], "count": v["count"]}
+                      for k, v in _histograms.items()}
+        counters = dict(_counters)
+
+    for (name, labels), h in sorted(histograms.items()):
+        header(name, "histogram")
+        for limit, count in zip(LATENCY_BUCKETS_MS, h["buckets"]):
+            lines.append(f"{name}_bucket{_fmt_labels(labels, {'le': limit})} {count}")
+        lines.append(f"{name}_bucket{_fmt_labels(labels, {'le': '+Inf'})} {h['count']}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {h['sum']:.3f}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {h['count']}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, "counter")
+        lines.append(f"{name}{_fmt_labels(labels)} {value}")
+
+    for name, samples in (extra_gauges or {}).items():
+        header(name, "gauge")
+        for labels, value in samples:
+            lines.append(f"{name}{_fmt_labels(tuple(sorted(labels.items())))} {value}")
+
+    return "\n".join(lines) + "\n"